@@ -25,31 +25,60 @@ from random import randint
 from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client, idle
 
-from plugins import glovar
-from plugins.functions.etc import delay
-from plugins.functions.timers import backup_files, interval_hour_01, reset_data, send_count, update_status
-
 # Enable logging
 logger = logging.getLogger(__name__)
 
-# Config session
-app = Client(session_name="account")
-app.start()
+# The process pool workers import this module, the bot should only run in the main process.
+# The plugins are imported here too, so the workers never load the data or clean the tmp directory
+if __name__ == "__main__":
+    from plugins import glovar
+    from plugins.functions.etc import delay, shutdown_executors, wait_executors
+    from plugins.functions.receive import check_shadows
+    from plugins.functions.timers import backup_files, check_albums, check_load, check_timeout, flush_count
+    from plugins.functions.timers import interval_hour_01, reset_data, send_count, sort_words, update_status
+
+    # Config session
+    app = Client(session_name="account")
+    app.start()
+
+    # Send online status
+    delay(3, update_status, [app, "online"])
+
+    # Timer
+    scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
+    scheduler.add_job(interval_hour_01, "interval", hours=1)
+    scheduler.add_job(check_albums, "interval", [app], seconds=1)
+    scheduler.add_job(check_load, "interval", [app], seconds=10)
+    scheduler.add_job(check_shadows, "interval", [app], seconds=1)
+    scheduler.add_job(check_timeout, "interval", [app], seconds=glovar.time_quarantine)
+    scheduler.add_job(flush_count, "interval", seconds=glovar.time_count)
+    scheduler.add_job(sort_words, "interval", hours=1)
+    scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
+    scheduler.add_job(backup_files, "cron", [app], hour=20)
+    scheduler.add_job(send_count, "cron", [app], hour=21)
+    scheduler.add_job(reset_data, "cron", [app], day=glovar.date_reset, hour=22)
+    scheduler.start()
+
+    # Hold
+    idle()
+
+    # Stop the timers, the running jobs are finished
+    scheduler.shutdown()
+
+    # Apply the rule updates in shadow mode at once
+    check_shadows(app, True)
+
+    # Finish the queued tasks while the client is still connected, they may send messages
+    wait_executors()
 
-# Send online status
-delay(3, update_status, [app, "online"])
+    # Save the pending counts, including the hits of the finished tasks
+    flush_count()
 
-# Timer
-scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
-scheduler.add_job(interval_hour_01, "interval", hours=1)
-scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
-scheduler.add_job(backup_files, "cron", [app], hour=20)
-scheduler.add_job(send_count, "cron", [app], hour=21)
-scheduler.add_job(reset_data, "cron", [app], day=glovar.date_reset, hour=22)
-scheduler.start()
+    # Write the saves and shut down the executors
+    shutdown_executors()
 
-# Hold
-idle()
+    # Stop
+    app.stop()
 
-# Stop
-app.stop()
+    # Stop the process pool
+    glovar.pools.get("pool") and glovar.pools["pool"].terminate()
@@ -18,16 +18,16 @@
 
 import logging
 from json import dumps
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from pyrogram import Client
 from pyrogram.types import Message
 
 from .. import glovar
 from .decorators import threaded
-from .etc import code, code_block, get_forward_name, get_md5sum, get_text, lang, thread
+from .context import MessageContext, get_context
+from .etc import code, code_block, general_link, lang, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path
-from .image import get_file_id
 from .telegram import forward_messages, send_document, send_message
 
 # Enable logging
@@ -54,10 +54,12 @@ def format_data(sender: str, receivers: List[str], action: str, action_type: str
 
 
 def forward_evidence(client: Client, message: Message, level: str,
-                     more: str = None) -> Optional[Union[bool, Message]]:
+                     more: str = None, context: MessageContext = None) -> Optional[Union[bool, Message]]:
     # Forward the message to the watch channel as evidence
     result = None
     try:
+        context = context or get_context(message)
+
         # Basic information
         uid = message.from_user.id
         text = (f"{lang('project')}{lang('colon')}{code(glovar.sender)}\n"
@@ -74,7 +76,7 @@ def forward_evidence(client: Client, message: Message, level: str,
         if message.game:
             text += f"{lang('message_game')}{lang('colon')}{code(message.game.short_name)}\n"
 
-        forward_name = get_forward_name(message)
+        forward_name = context.forward_name
         if forward_name:
             text += f"{lang('from_name')}{lang('colon')}{code(forward_name)}\n"
 
@@ -114,32 +116,7 @@ def forward_evidence(client: Client, message: Message, level: str,
 
 def get_content(message: Message) -> str:
     # Get the message that will be added to lists, return the file_id and text's hash
-    result = ""
-    try:
-        if not message:
-            return ""
-
-        file_id, _, _ = get_file_id(message)
-        text = get_text(message)
-
-        if file_id:
-            result += file_id
-
-        if message.audio:
-            result += message.audio.file_id
-
-        if message.document:
-            result += message.document.file_id
-
-        if message.sticker and message.sticker.is_animated:
-            result += message.sticker.file_id
-
-        if text:
-            result += get_md5sum("string", text)
-    except Exception as e:
-        logger.warning(f"Get content error: {e}", exc_info=True)
-
-    return result
+    return get_context(message).content
 
 
 @threaded()
@@ -166,13 +143,26 @@ def send_help(client: Client, cid: int, text: str, mid: int = None) -> bool:
     return result
 
 
+def send_quarantine(client: Client, word_type: str, word: str) -> bool:
+    # Send the debug message of a quarantined rule
+    text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+            f"{lang('action')}{lang('colon')}{code(lang('quarantine'))}\n"
+            f"{lang('rule')}{lang('colon')}{code(word)}\n"
+            f"{lang('reason')}{lang('colon')}{code(lang('regex_timeout'))}\n"
+            f"{lang('more')}{lang('colon')}{code(f'{word_type}_words')}\n")
+
+    return thread(send_help, (client, glovar.debug_channel_id, text))
+
+
 def share_data(client: Client, receivers: List[str], action: str, action_type: str,
                data: Union[bool, dict, int, str] = None, file: str = None, encrypt: bool = True) -> bool:
     # Use this function to share data in the channel
     try:
+        # Only the encrypted files need the crypto queue
         thread(
             target=share_data_thread,
-            args=(client, receivers, action, action_type, data, file, encrypt)
+            args=(client, receivers, action, action_type, data, file, encrypt),
+            queue=(file and encrypt and "crypto") or "io"
         )
 
         return True
@@ -216,7 +206,7 @@ def share_data_thread(client: Client, receivers: List[str], action: str, action_
             # Delete the tmp file
             if result:
                 for f in {file, file_path}:
-                    f.startswith("tmp/") and thread(delete_file, (f,))
+                    f.startswith("tmp/") and delete_file(f)
         else:
             text = format_data(
                 sender=glovar.sender,
@@ -238,16 +228,16 @@ def share_data_thread(client: Client, receivers: List[str], action: str, action_
     return False
 
 
-def share_regex_count(client: Client, word_type: str) -> bool:
+def share_regex_count(client: Client, word_type: str, words: Dict[str, int]) -> bool:
     # Use this function to share regex count to REGEX
     try:
         if not glovar.regex.get(word_type):
             return True
 
-        if not eval(f"glovar.{word_type}_words"):
+        if not words:
             return True
 
-        file = data_to_file(eval(f"glovar.{word_type}_words"))
+        file = data_to_file(words)
         share_data(
             client=client,
             receivers=["REGEX"],
@@ -0,0 +1,137 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pyrogram.types import Message
+
+from .etc import get_filename, get_forward_name, get_links, get_md5sum, get_text
+from .image import get_file_id
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class MessageContext:
+    # The fields derived from a message, each field is computed when it is first used
+    __slots__ = ("message", "_content", "_file_id", "_filename", "_forward_name", "_links", "_texts")
+
+    def __init__(self, message: Message):
+        self.message: Message = message
+        self._content: Optional[str] = None
+        self._file_id: Optional[Tuple[str, str, bool]] = None
+        self._filename: Optional[str] = None
+        self._forward_name: Optional[str] = None
+        self._links: Optional[List[str]] = None
+        self._texts: Dict[Tuple[bool, bool], str] = {}
+
+    @property
+    def content(self) -> str:
+        # The message that will be added to lists, the file_id and text's hash
+        if self._content is not None:
+            return self._content
+
+        result = ""
+        try:
+            message = self.message
+
+            if not message:
+                return ""
+
+            file_id, _, _ = self.file_id
+            text = self.text()
+
+            if file_id:
+                result += file_id
+
+            if message.audio:
+                result += message.audio.file_id
+
+            if message.document:
+                result += message.document.file_id
+
+            if message.sticker and message.sticker.is_animated:
+                result += message.sticker.file_id
+
+            if text:
+                result += get_md5sum("string", text)
+        except Exception as e:
+            logger.warning(f"Get content error: {e}", exc_info=True)
+
+        self._content = result
+
+        return result
+
+    @property
+    def file_id(self) -> Tuple[str, str, bool]:
+        # The image file id, file reference and whether it is a big image
+        if self._file_id is None:
+            self._file_id = get_file_id(self.message)
+
+        return self._file_id
+
+    @property
+    def filename(self) -> str:
+        # The file name of the document
+        if self._filename is None:
+            self._filename = get_filename(self.message)
+
+        return self._filename
+
+    @property
+    def forward_name(self) -> str:
+        # The name of the forward origin
+        if self._forward_name is None:
+            self._forward_name = get_forward_name(self.message)
+
+        return self._forward_name
+
+    @property
+    def links(self) -> List[str]:
+        # The links in the entities and the inline keyboard
+        if self._links is None:
+            self._links = get_links(self.message)
+
+        return self._links
+
+    def text(self, normal: bool = False, printable: bool = True) -> str:
+        # The message's text with the conversion flags
+        key = (normal, printable)
+
+        if key not in self._texts:
+            self._texts[key] = get_text(self.message, normal, printable)
+
+        return self._texts[key]
+
+
+def get_context(message: Message) -> MessageContext:
+    # Get the context of the message, all the checks of a message share one context
+    result = getattr(message, "_watch_context", None)
+
+    if result is not None:
+        return result
+
+    result = MessageContext(message)
+
+    try:
+        message._watch_context = result
+    except Exception as e:
+        logger.warning(f"Get context error: {e}", exc_info=True)
+
+    return result
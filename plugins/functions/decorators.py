@@ -18,15 +18,68 @@
 
 import logging
 from functools import wraps
+from hashlib import md5
+from time import time
 
 from pyrogram.errors import FloodWait
 
-from .etc import thread, wait_flood
+from .. import glovar
+from .etc import end_turn, get_verdict, set_verdict, thread, wait_flood, wait_turn
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def cached(func):
+    # Reuse the result of a text check across messages until the rules change, a failed check returns None
+    @wraps(func)
+    def wrapper(*args):
+        # Key by the rule-set version and the hashes of the texts
+        key = (glovar.version_rules, func.__name__)
+        key += tuple(md5(v.encode()).digest() if isinstance(v, str) else v for v in args)
+
+        result = get_verdict(key)
+
+        if result is not None:
+            return result
+
+        result = func(*args)
+        result is not None and set_verdict(key, result)
+
+        return result
+    return wrapper
+
+
+def memoized(func):
+    # Reuse the result of a text predicate within the current detection
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        memo = getattr(glovar.memo, "results", None)
+
+        if memo is None:
+            return func(*args, **kwargs)
+
+        # The result may depend on other objects, such as the message
+        if any(v is not None and not isinstance(v, (bool, dict, str)) for v in list(args) + list(kwargs.values())):
+            return func(*args, **kwargs)
+
+        # Key by the predicate, the texts and the flags, the hits are derived from the text
+        key = (func.__name__,)
+        key += tuple(v for v in args if not isinstance(v, dict))
+        key += tuple(sorted((k, v) for k, v in kwargs.items() if not isinstance(v, dict)))
+
+        # The counters are only statistics, a lost update between threads does not matter
+        if key in memo:
+            glovar.memo_counts["hits"] += 1
+            return memo[key]
+
+        glovar.memo_counts["misses"] += 1
+        result = memo[key] = func(*args, **kwargs)
+
+        return result
+    return wrapper
+
+
 def retry(func):
     # FloodWait retry
     @wraps(func)
@@ -46,11 +99,27 @@ def retry(func):
     return wrapper
 
 
-def threaded(daemon: bool = True):
-    # Run with thread
+def scheduled(name: str):
+    # Run the handler when its priority class gets a schedule slot
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time()
+            waited = wait_turn(name)
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_turn(name, waited, start)
+        return wrapper
+    return decorator
+
+
+def threaded(queue: str = "io"):
+    # Run in the bounded executor of the queue
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            return thread(func, args, kwargs, daemon)
+            return thread(func, args, kwargs, queue)
         return wrapper
     return decorator
@@ -18,15 +18,18 @@
 
 import logging
 import re
+from concurrent.futures import Future
 from datetime import datetime
 from hashlib import md5
+from multiprocessing import get_context
+from multiprocessing.pool import Pool
 from html import escape
 from random import choice, uniform
 from re import sub
 from string import ascii_letters, digits
-from threading import Thread, Timer
+from threading import Lock, Timer
 from time import localtime, sleep, strftime, time
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from unicodedata import normalize
 
 from cryptography.fernet import Fernet
@@ -38,6 +41,7 @@ from pyrogram.types import InlineKeyboardMarkup, Message, MessageEntity, User
 from textblob import TextBlob
 
 from .. import glovar
+from .words import init_pool
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -63,6 +67,42 @@ def bold(text: Any) -> str:
     return result
 
 
+def build_pool() -> bool:
+    # Build the process pool after the rules stay unchanged for a while
+    try:
+        # Wait until the rule updates that come together are all applied
+        version = glovar.version_rules
+
+        while True:
+            sleep(glovar.time_pool)
+
+            if version == glovar.version_rules:
+                break
+
+            version = glovar.version_rules
+
+        # The forkserver is a fresh process, so the workers never inherit the locks held by other threads,
+        # the workers only import the words module, which never imports glovar
+        rules = {word_type: list(glovar.compiled[word_type]["order"])
+                 for word_type in glovar.regex_text if glovar.compiled.get(word_type)}
+        pool = get_context("forkserver").Pool(glovar.pool_workers, init_pool, (rules,))
+
+        with glovar.locks["pool"]:
+            # The old workers finish their tasks and exit
+            glovar.pools.get("pool") and glovar.pools["pool"].close()
+            glovar.pools["pool"] = pool
+            glovar.pools["version"] = version
+
+        return True
+    except Exception as e:
+        logger.warning(f"Build pool error: {e}", exc_info=True)
+    finally:
+        with glovar.locks["pool"]:
+            glovar.pools["building"] = False
+
+    return False
+
+
 def code(text: Any) -> str:
     # Get a code text
     result = ""
@@ -131,6 +171,31 @@ def delay(secs: int, target: Callable, args: list = None) -> bool:
     return result
 
 
+def end_turn(name: str, waited: float, start: float) -> bool:
+    # Free the schedule slot, record the latency of the priority class
+    try:
+        if waited < 0:
+            return False
+
+        condition = glovar.locks["schedule"]
+
+        with condition:
+            glovar.schedule["running"] -= 1
+            condition.notify_all()
+
+            latency = glovar.latencies.setdefault(name, {"count": 0, "max": 0.0, "run": 0.0, "wait": 0.0})
+            latency["count"] += 1
+            latency["max"] = max(latency["max"], waited)
+            latency["run"] += time() - start - waited
+            latency["wait"] += waited
+
+        return True
+    except Exception as e:
+        logger.warning(f"End turn error: {e}", exc_info=True)
+
+    return False
+
+
 def general_link(text: Union[int, str], link: str) -> str:
     # Get a general link
     result = ""
@@ -432,6 +497,24 @@ def get_md5sum(the_type: str, ctx: str) -> str:
     return result
 
 
+def get_memo_rate() -> str:
+    # Get the hit rate of the detection memo
+    result = "0.0%"
+
+    try:
+        hits = glovar.memo_counts["hits"]
+        total = hits + glovar.memo_counts["misses"]
+
+        if not total:
+            return result
+
+        result = f"{hits / total:.1%} ({hits} / {total})"
+    except Exception as e:
+        logger.warning(f"Get memo rate error: {e}", exc_info=True)
+
+    return result
+
+
 def get_now() -> int:
     # Get time for now
     result = 0
@@ -444,6 +527,39 @@ def get_now() -> int:
     return result
 
 
+def get_pool() -> Optional[Pool]:
+    # Get the process pool that has the current rules, the texts are checked in the threads until it is ready
+    result = None
+
+    try:
+        with glovar.locks["pool"]:
+            if glovar.pools.get("pool") and glovar.pools.get("version") == glovar.version_rules:
+                return glovar.pools["pool"]
+
+            # The rules are changed, build a new pool in the background
+            if not glovar.pools.get("building"):
+                glovar.pools["building"] = True
+                thread(build_pool, (), queue="regex")
+    except Exception as e:
+        logger.warning(f"Get pool error: {e}", exc_info=True)
+
+    return result
+
+
+def get_queue_depth() -> str:
+    # Get the pending task count and the peak count of each queue
+    result = ""
+
+    try:
+        with glovar.locks["queue"]:
+            result = ", ".join(f"{queue} {depth['pending']} / {depth['peak']}"
+                               for queue, depth in glovar.queues.items())
+    except Exception as e:
+        logger.warning(f"Get queue depth error: {e}", exc_info=True)
+
+    return result
+
+
 def get_readable_time(secs: int = 0, the_format: str = "%Y%m%d%H%M%S") -> str:
     # Get a readable time string
     result = ""
@@ -531,6 +647,21 @@ def get_report_record(message: Message) -> Dict[str, str]:
     return record
 
 
+def get_schedule_latency() -> str:
+    # Get the average waiting time, the max waiting time and the average running time of each priority class
+    result = ""
+
+    try:
+        with glovar.locks["schedule"]:
+            result = ", ".join(f"{name} {latency['wait'] / latency['count']:.2f}s / {latency['max']:.2f}s / "
+                               f"{latency['run'] / latency['count']:.2f}s ({latency['count']})"
+                               for name, latency in glovar.latencies.items() if latency["count"])
+    except Exception as e:
+        logger.warning(f"Get schedule latency error: {e}", exc_info=True)
+
+    return result
+
+
 def get_stripped_link(link: str) -> str:
     # Get stripped link
     result = ""
@@ -592,6 +723,33 @@ def get_text(message: Message, normal: bool = False, printable: bool = True) ->
     return text
 
 
+def get_turn() -> Optional[Tuple[int, int, float]]:
+    # Get the next waiting handler, the handler that waited too long goes first regardless of its class
+    now = time()
+
+    if not glovar.schedule["waiting"]:
+        return None
+
+    return min(glovar.schedule["waiting"],
+               key=lambda entry: (entry[0] if now - entry[2] < glovar.time_starve else -1, entry[1]))
+
+
+def get_user_lock(uid: int) -> Lock:
+    # Get the lock of the user's shard
+    return glovar.user_locks[uid % len(glovar.user_locks)]
+
+
+def get_verdict(key: tuple) -> Any:
+    # Get the cached verdict, None if it is not cached
+    with glovar.locks["verdict"]:
+        if key not in glovar.verdicts:
+            return None
+
+        glovar.verdicts.move_to_end(key)
+
+        return glovar.verdicts[key]
+
+
 def lang(text: str) -> str:
     # Get the text
     result = ""
@@ -603,6 +761,18 @@ def lang(text: str) -> str:
     return result
 
 
+def lock_users(operation: str) -> bool:
+    # Acquire or release the locks of all user shards, for the changes of all users
+    if operation == "acquire":
+        for lock in glovar.user_locks:
+            lock.acquire()
+    else:
+        for lock in reversed(glovar.user_locks):
+            lock.release()
+
+    return True
+
+
 def mention_id(uid: int) -> str:
     # Get a ID mention string
     result = ""
@@ -639,6 +809,95 @@ def random_str(i: int) -> str:
     return result
 
 
+def reset_verdicts() -> bool:
+    # Invalidate the cached verdicts after the rules changed
+    try:
+        with glovar.locks["verdict"]:
+            glovar.version_rules += 1
+            glovar.verdicts.clear()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Reset verdicts error: {e}", exc_info=True)
+
+    return False
+
+
+def set_queue_depth(queue: str, change: int) -> bool:
+    # Change the pending task count of the queue
+    try:
+        with glovar.locks["queue"]:
+            depth = glovar.queues[queue]
+            depth["pending"] += change
+            depth["peak"] = max(depth["peak"], depth["pending"])
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set queue depth error: {e}", exc_info=True)
+
+    return False
+
+
+def set_verdict(key: tuple, verdict: Any) -> bool:
+    # Cache the verdict, the first item of the key is the rule-set version when the check started
+    with glovar.locks["verdict"]:
+        # The rules may be changed during the check
+        if key[0] != glovar.version_rules:
+            return False
+
+        glovar.verdicts[key] = verdict
+
+        while len(glovar.verdicts) > glovar.limit_verdict:
+            glovar.verdicts.popitem(last=False)
+
+    return True
+
+
+def shutdown_executors() -> bool:
+    # Drain the executors, the queued tasks and the tasks they submit are finished before the program exits
+    try:
+        wait_executors()
+
+        for executor in glovar.executors.values():
+            executor.shutdown()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Shutdown executors error: {e}", exc_info=True)
+
+    return False
+
+
+def submit(queue: str, target: Callable, args: tuple = (), kwargs: dict = None) -> Optional[Future]:
+    # Run a function in the bounded executor of the queue
+    result = None
+
+    try:
+        set_queue_depth(queue, 1)
+        result = glovar.executors[queue].submit(target, *args, **(kwargs or {}))
+        result.add_done_callback(lambda future: submit_done(queue, target, future))
+    except Exception as e:
+        result is None and set_queue_depth(queue, -1)
+        logger.warning(f"Submit to {queue} error: {e}", exc_info=True)
+
+    return result
+
+
+def submit_done(queue: str, target: Callable, future: Future) -> bool:
+    # Count the finished task, log the error that the task did not handle
+    try:
+        set_queue_depth(queue, -1)
+
+        if not future.cancelled() and future.exception():
+            logger.warning(f"Task {target.__name__} error: {future.exception()}", exc_info=future.exception())
+
+        return True
+    except Exception as e:
+        logger.warning(f"Submit done error: {e}", exc_info=True)
+
+    return False
+
+
 def t2t(text: str, normal: bool, printable: bool, pure: bool = False) -> str:
     # Convert the string, text to text
     result = text
@@ -649,7 +908,7 @@ def t2t(text: str, normal: bool, printable: bool, pure: bool = False) -> str:
 
         if glovar.normalize and normal:
             for special in ["spc", "spe"]:
-                result = "".join(eval(f"glovar.{special}_dict").get(t, t) for t in result)
+                result = "".join(glovar.special_dicts[special].get(t, t) for t in result)
 
             result = normalize("NFKC", result)
 
@@ -667,18 +926,29 @@ def t2t(text: str, normal: bool, printable: bool, pure: bool = False) -> str:
     return result
 
 
-def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = True) -> bool:
-    # Call a function using thread
-    result = False
+def thread(target: Callable, args: tuple, kwargs: dict = None, queue: str = "io") -> bool:
+    # Call a function in the bounded executor of the queue
+    return bool(submit(queue, target, args, kwargs))
 
+
+def wait_executors() -> bool:
+    # Wait until the queued tasks and the tasks they submit are finished
     try:
-        t = Thread(target=target, args=args, kwargs=kwargs, daemon=daemon)
-        t.daemon = daemon
-        result = t.start() or True
+        # A task is counted until it returns, so the new tasks it submits are counted before it is done
+        while True:
+            with glovar.locks["queue"]:
+                pending = sum(depth["pending"] for depth in glovar.queues.values())
+
+            if not pending:
+                break
+
+            sleep(0.1)
+
+        return True
     except Exception as e:
-        logger.warning(f"Thread error: {e}", exc_info=True)
+        logger.warning(f"Wait executors error: {e}", exc_info=True)
 
-    return result
+    return False
 
 
 def wait_flood(e: FloodWait) -> bool:
@@ -691,3 +961,33 @@ def wait_flood(e: FloodWait) -> bool:
         logger.warning(f"Wait flood error: {e}", exc_info=True)
 
     return result
+
+
+def wait_turn(name: str) -> float:
+    # Wait for a schedule slot by the priority class, return the waiting time
+    start = time()
+
+    try:
+        condition = glovar.locks["schedule"]
+
+        with condition:
+            glovar.schedule["count"] += 1
+            entry = (glovar.priorities[name], glovar.schedule["count"], start)
+            glovar.schedule["waiting"].append(entry)
+
+            try:
+                while glovar.schedule["running"] >= glovar.schedule_slots or get_turn() is not entry:
+                    condition.wait(1)
+            finally:
+                glovar.schedule["waiting"].remove(entry)
+
+            glovar.schedule["running"] += 1
+
+            # The next handler may also have a free slot
+            condition.notify_all()
+
+        return time() - start
+    except Exception as e:
+        logger.warning(f"Wait turn error: {e}", exc_info=True)
+
+    return -1.0
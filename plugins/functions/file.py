@@ -20,7 +20,7 @@
 import logging
 from os import remove
 from os.path import exists
-from pickle import dump
+from pickle import dump, dumps
 from shutil import copyfile
 from typing import Any
 
@@ -28,8 +28,7 @@ from pyAesCrypt import decryptFile, encryptFile
 from pyrogram import Client
 
 from .. import glovar
-from .decorators import threaded
-from .etc import random_str
+from .etc import lock_users, random_str, thread
 from .telegram import download_media
 
 # Enable logging
@@ -83,6 +82,21 @@ def delete_file(path: str) -> bool:
     return False
 
 
+def get_data(file: str) -> Any:
+    # Get the global variable of a data file
+    result = None
+
+    try:
+        if file.endswith("_words"):
+            result = glovar.words.get(file.split("_")[0])
+        else:
+            result = getattr(glovar, file, None)
+    except Exception as e:
+        logger.warning(f"Get data error: {e}", exc_info=True)
+
+    return result
+
+
 def get_downloaded_path(client: Client, file_id: str, file_ref: str) -> str:
     # Download file, get it's path on local machine
     final_path = ""
@@ -98,6 +112,26 @@ def get_downloaded_path(client: Client, file_id: str, file_ref: str) -> str:
     return final_path
 
 
+def get_dumped(file: str) -> bytes:
+    # Pickle a global variable under the locks of its writers, so the dump is a consistent snapshot
+    if file == "user_ids":
+        lock_users("acquire")
+
+        try:
+            return dumps(get_data(file))
+        finally:
+            lock_users("release")
+
+    # The rules and their rates are changed under the regex lock, the other ids under the receive lock
+    if file == "rates" or file.endswith("_words"):
+        lock = glovar.locks["regex"]
+    else:
+        lock = glovar.locks["receive"]
+
+    with lock:
+        return dumps(get_data(file))
+
+
 def get_new_path(extension: str = "") -> str:
     # Get a new path in tmp directory
     result = ""
@@ -114,20 +148,51 @@ def get_new_path(extension: str = "") -> str:
     return result
 
 
-@threaded(daemon=False)
 def save(file: str) -> bool:
-    # Save a global variable to a file
+    # Save a global variable to a file, a pending save of the same file also saves the new changes
+    with glovar.locks["save"]:
+        if file in glovar.saving:
+            return True
+
+        glovar.saving.add(file)
+
+    return thread(save_thread, (file,), queue="persistence")
+
+
+def save_thread(file: str) -> bool:
+    # Save thread, the saves are written one by one
     result = False
 
     try:
         if not glovar:
             return False
 
+        # The changes after this point need another save
+        with glovar.locks["save"]:
+            glovar.saving.discard(file)
+
+        content = get_dumped(file)
+
         with open(f"data/.{file}", "wb") as f:
-            dump(eval(f"glovar.{file}"), f)
+            f.write(content)
 
         result = copyfile(f"data/.{file}", f"data/{file}") or True
     except Exception as e:
         logger.warning(f"Save error: {e}", exc_info=True)
 
     return result
+
+
+def set_data(file: str, data: Any) -> bool:
+    # Set the global variable of a data file
+    try:
+        if file.endswith("_words"):
+            glovar.words[file.split("_")[0]] = data
+        else:
+            setattr(glovar, file, data)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set data error: {e}", exc_info=True)
+
+    return False
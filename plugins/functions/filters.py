@@ -20,24 +20,31 @@ import logging
 import re
 from copy import deepcopy
 from string import ascii_lowercase
-from typing import Match, Optional, Union
+from typing import Any, Callable, Dict, List, Match, Optional, Tuple, Union
 
 from pyrogram import Client, filters
 from pyrogram.types import Message, User, WebPage
 
 from .. import glovar
 from .channel import get_content
-from .etc import get_channel_link, get_entity_text, get_filename, get_forward_name, get_lang, get_md5sum, get_now
-from .etc import get_links, get_stripped_link, get_text, thread
-from .file import delete_file, get_downloaded_path, save
+from .context import MessageContext, get_context
+from .decorators import cached, memoized
+from .etc import get_channel_link, get_entity_text, get_lang, get_md5sum, get_now, get_pool, get_stripped_link
+from .etc import get_text, submit, thread
+from .file import delete_file, get_downloaded_path
 from .group import get_description, get_member, get_pinned
 from .ids import init_user_id
-from .image import get_color, get_file_id, get_ocr, get_qrcode
+from .image import get_color, get_ocr, get_qrcode
 from .telegram import get_sticker_title, resolve_username
+from .words import get_folded, get_matched_forms, get_pool_hits
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Whitespace patterns of the text forms
+collapse_pattern = re.compile(r"\s{2,}")
+strip_pattern = re.compile(r"\s")
+
 
 def is_class_c(_, __, message: Message) -> bool:
     # Check if the message is sent from Class C personnel
@@ -235,14 +242,189 @@ watch_delete = filters.create(
 )
 
 
-def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
+@memoized
+def get_forms(text: str) -> Tuple[str, str]:
+    # Get the whitespace-collapsed form and the whitespace-stripped form of the folded text, all word types share them
+    collapsed = ""
+    stripped = ""
+    try:
+        if not text:
+            return "", ""
+
+        text = get_folded(text)
+        collapsed = collapse_pattern.sub(" ", text)
+
+        # The stripped form is only needed if it is different
+        if " " in collapsed:
+            stripped = strip_pattern.sub("", text)
+    except Exception as e:
+        logger.warning(f"Get forms error: {e}", exc_info=True)
+
+    return collapsed, stripped
+
+
+def get_image_detection(message: Message, context: MessageContext, image_path: str,
+                        data: Dict[str, Any]) -> Optional[str]:
+    # Check the downloaded image with QR code and OCR
+    # Check declared status
+    if is_declared_message(None, None, message):
+        return ""
+
+    # Check hash
+    image_hash = image_path and get_md5sum("file", image_path)
+
+    if not image_path or not image_hash or image_hash in glovar.except_ids["temp"]:
+        return None
+
+    # Check declare status
+    if is_declared_message(None, None, message):
+        return ""
+
+    # Get QR code
+    qrcode = get_qrcode(image_path)
+    if qrcode:
+        if is_ban_text(qrcode, False):
+            return ""
+
+        return "ban"
+
+    # Skip OCR under high load
+    if data["degraded"]:
+        return None
+
+    # Get OCR
+    ocr = get_ocr(image_path)
+    data["ocr"] = ocr
+
+    if not ocr:
+        return None
+
+    ocr_hits = get_regex_hits(ocr, True)
+
+    if is_ban_text(ocr, True, hits=ocr_hits):
+        return ""
+
+    if is_wb_text(ocr, True, ocr_hits):
+        return "ban"
+
+    message_text = context.text()
+
+    if not message_text:
+        return None
+
+    data["all_text"] = message_text + ocr
+    data["all_hits"] = get_regex_hits(data["all_text"], False)
+
+    if is_ban_text(data["all_text"], False, hits=data["all_hits"]):
+        return ""
+
+    if is_wb_text(data["all_text"], False, data["all_hits"]):
+        return "ban"
+
+    return None
+
+
+@memoized
+def get_regex_hits(text: str, ocr: bool) -> Dict[str, str]:
+    # Get the first hit rule of every word type that the text filters use
+    result = {}
+    try:
+        if not text:
+            return {}
+
+        # Key the cached results by the collapsed form, both forms of the text can be derived from it
+        collapsed, _ = get_forms(text)
+        result = get_regex_results(collapsed, ocr) or {}
+
+        # Count the hits even if the result is cached, the count will be saved by flush_count
+        for word_type, word in result.items():
+            glovar.counts.append((word_type, word))
+    except Exception as e:
+        logger.warning(f"Get regex hits error: {e}", exc_info=True)
+
+    return result
+
+
+@cached
+def get_regex_results(text: str, ocr: bool) -> Optional[Dict[str, str]]:
+    # Get the first hit rule of every word type, without counting, return None if the check failed
+    result = None
+    try:
+        forms = get_forms(text)
+
+        # Check the large text in the process pool, so the other threads are not blocked
+        pool = glovar.pool and len(text) > glovar.pool_size and get_pool()
+
+        if pool:
+            hits, timeouts = pool.apply(get_pool_hits, (forms, ocr, glovar.time_regex, glovar.regex_text))
+            glovar.timeouts.extend(timeouts)
+        else:
+            hits = {}
+
+            for word_type in glovar.regex_text:
+                word, _ = get_regex_match(word_type, text, ocr, forms, False)
+
+                if word:
+                    hits[word_type] = word
+
+        # Sample the text for the rule sets in shadow mode
+        for word_type in list(glovar.shadows):
+            shadow = glovar.shadows.get(word_type)
+            shadow and shadow["samples"].append((text, ocr))
+
+        result = hits
+    except Exception as e:
+        logger.warning(f"Get regex results error: {e}", exc_info=True)
+
+    return result
+
+
+def get_regex_match(word_type: str, text: str, ocr: bool = False,
+                    forms: Tuple[str, str] = None, count: bool = True) -> (str, Optional[Match]):
+    # Get the hit rule and the match of the word type
+    word = ""
+    result = None
+    try:
+        if not text:
+            return "", None
+
+        # Take a reference of the current snapshot, it never changes after it is published
+        compiled = glovar.compiled.get(word_type, {})
+
+        timeouts = []
+        profile = {} if glovar.profile else None
+
+        forms = forms or get_forms(text)
+        word, result = get_matched_forms(compiled, forms, ocr, glovar.time_regex, timeouts, profile)
+
+        # The records will be merged when MANAGE or REGEX asks
+        profile and glovar.profile_records.append((word_type, profile))
+
+        # The slow rules will be checked by check_timeout
+        for timeout_word in timeouts:
+            glovar.timeouts.append((word_type, timeout_word))
+
+        # Count the hit, the count will be saved by flush_count
+        if result and count:
+            glovar.counts.append((word_type, word))
+    except Exception as e:
+        logger.warning(f"Get regex match error: {e}", exc_info=True)
+
+    return word, result
+
+
+@memoized
+def is_ad_text(text: str, ocr: bool, matched: str = "", hits: Dict[str, str] = None) -> str:
     # Check if the text is ad text
     try:
         if not text:
             return ""
 
+        if hits is None:
+            hits = get_regex_hits(text, ocr)
+
         for c in ascii_lowercase:
-            if c != matched and is_regex_text(f"ad{c}", text, ocr):
+            if c != matched and hits.get(f"ad{c}"):
                 return c
     except Exception as e:
         logger.warning(f"Is ad text error: {e}", exc_info=True)
@@ -250,15 +432,19 @@ def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
     return ""
 
 
-def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
+@memoized
+def is_ban_text(text: str, ocr: bool, message: Message = None, hits: Dict[str, str] = None) -> bool:
     # Check if the text is ban text
     try:
-        if is_regex_text("ban", text, ocr):
+        if hits is None:
+            hits = get_regex_hits(text, ocr)
+
+        if hits.get("ban"):
             return True
 
         # ad + con
-        ad = is_regex_text("ad", text, ocr)
-        con = is_con_text(text, ocr)
+        ad = hits.get("ad")
+        con = is_con_text(text, ocr, hits)
 
         if ad and con:
             return True
@@ -270,7 +456,7 @@ def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
             return True
 
         # ad_ + con
-        ad = is_ad_text(text, ocr)
+        ad = is_ad_text(text, ocr, hits=hits)
 
         if ad and con:
             return True
@@ -281,7 +467,7 @@ def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
 
         # ad_ + ad_
         if ad:
-            ad = is_ad_text(text, ocr, ad)
+            ad = is_ad_text(text, ocr, ad, hits)
             return bool(ad)
     except Exception as e:
         logger.warning(f"Is ban text error: {e}", exc_info=True)
@@ -289,11 +475,15 @@ def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
     return False
 
 
-def is_bio_text(text: str) -> bool:
+@memoized
+def is_bio_text(text: str, hits: Dict[str, str] = None) -> bool:
     # Check if the text is bio text
     try:
-        if (is_regex_text("bio", text)
-                or is_ban_text(text, False)):
+        if hits is None:
+            hits = get_regex_hits(text, False)
+
+        if (hits.get("bio")
+                or is_ban_text(text, False, hits=hits)):
             return True
     except Exception as e:
         logger.warning(f"Is bio text error: {e}", exc_info=True)
@@ -340,12 +530,16 @@ def is_class_d_user(user: Union[int, User]) -> bool:
     return False
 
 
-def is_con_text(text: str, ocr: bool) -> bool:
+@memoized
+def is_con_text(text: str, ocr: bool, hits: Dict[str, str] = None) -> bool:
     # Check if the text is con text
     try:
-        if (is_regex_text("con", text, ocr)
-                or is_regex_text("iml", text, ocr)
-                or is_regex_text("pho", text, ocr)):
+        if hits is None:
+            hits = get_regex_hits(text, ocr)
+
+        if (hits.get("con")
+                or hits.get("iml")
+                or hits.get("pho")):
             return True
     except Exception as e:
         logger.warning(f"Is con text error: {e}", exc_info=True)
@@ -407,9 +601,10 @@ def is_emoji(the_type: str, text: str, message: Message = None) -> bool:
     return False
 
 
-def is_exe(message: Message) -> bool:
+def is_exe(message: Message, context: MessageContext = None) -> bool:
     # Check if the message contain a exe
     try:
+        context = context or get_context(message)
         extensions = ["apk", "bat", "cmd", "com", "exe", "msi", "pif", "scr", "vbs"]
         if message.document:
             if message.document.file_name:
@@ -424,7 +619,7 @@ def is_exe(message: Message) -> bool:
                     return True
 
         extensions.remove("com")
-        links = get_links(message)
+        links = context.links
         for link in links:
             for file_type in extensions:
                 if re.search(f"[.]{file_type}$", link, re.I):
@@ -488,6 +683,8 @@ def is_high_score_user(user: User) -> float:
     return 0.0
 
 
+@memoized
+@cached
 def is_lang(the_type: str, text: str) -> bool:
     # Check language
     try:
@@ -510,12 +707,16 @@ def is_lang(the_type: str, text: str) -> bool:
     return False
 
 
-def is_nm_text(text: str) -> bool:
+@memoized
+def is_nm_text(text: str, hits: Dict[str, str] = None) -> bool:
     # Check if the text is nm text
     try:
-        if (is_regex_text("nm", text)
-                or is_regex_text("bio", text)
-                or is_ban_text(text, False)):
+        if hits is None:
+            hits = get_regex_hits(text, False)
+
+        if (hits.get("nm")
+                or hits.get("bio")
+                or is_ban_text(text, False, hits=hits)):
             return True
     except Exception as e:
         logger.warning(f"Is nm text error: {e}", exc_info=True)
@@ -537,48 +738,23 @@ def is_restricted_channel(message: Message) -> bool:
     return False
 
 
-def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = False) -> Optional[Match]:
+@memoized
+def is_regex_text(word_type: str, text: str, ocr: bool = False) -> Optional[Match]:
     # Check if the text hit the regex rules
     result = None
     try:
-        if text:
-            if not again:
-                text = re.sub(r"\s{2,}", " ", text)
-            elif " " in text:
-                text = re.sub(r"\s", "", text)
-            else:
-                return None
-        else:
-            return None
-
-        with glovar.locks["regex"]:
-            words = list(eval(f"glovar.{word_type}_words"))
-
-        for word in words:
-            if ocr and "(?# nocr)" in word:
-                continue
-
-            result = re.search(word, text, re.I | re.S | re.M)
-
-            # Count and return
-            if result:
-                count = eval(f"glovar.{word_type}_words").get(word, 0)
-                count += 1
-                eval(f"glovar.{word_type}_words")[word] = count
-                save(f"{word_type}_words")
-                return result
-
-        # Try again
-        return is_regex_text(word_type, text, ocr, True)
+        _, result = get_regex_match(word_type, text, ocr)
     except Exception as e:
         logger.warning(f"Is regex text error: {e}", exc_info=True)
 
     return result
 
 
-def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
+def is_tgl(client: Client, message: Message, friend: bool = False, context: MessageContext = None) -> bool:
     # Check if the message includes the Telegram link
     try:
+        context = context or get_context(message)
+
         # Bypass prepare
         gid = message.chat.id
         description = get_description(client, gid).lower()
@@ -587,7 +763,7 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
 
         # Check links
         bypass = get_stripped_link(get_channel_link(message))
-        links = get_links(message)
+        links = context.links
         tg_links = [lk.lower() for lk in links if is_regex_text("tgl", lk)]
 
         # Define a bypass link filter function
@@ -622,7 +798,7 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
             return True
 
         # Check text
-        message_text = get_text(message, True, True).lower()
+        message_text = context.text(True, True).lower()
         for bypass in bypass_list:
             message_text = message_text.replace(bypass, "")
 
@@ -667,341 +843,491 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
     return False
 
 
-def is_watch_message(client: Client, message: Message) -> str:
+def is_watch_album(client: Client, messages: List[Message], contexts: List[MessageContext]) -> List[str]:
+    # Check the messages of an album in parallel, return the detection of each message
+    result = [""] * len(messages)
+
+    try:
+        futures = [submit("detect", is_watch_message, (client, message, context))
+                   for message, context in zip(messages, contexts)]
+        result = [(future and future.result()) or "" for future in futures]
+    except Exception as e:
+        logger.warning(f"Is watch album error: {e}", exc_info=True)
+
+    return result
+
+
+def is_watch_message(client: Client, message: Message, context: MessageContext = None) -> str:
     # Check if the message should be watched
     result = ""
-    need_delete = []
+    context = context or get_context(message)
+    data = {
+        "all_hits": {},
+        "all_text": "",
+        "degraded": glovar.load["degraded"],
+        "image_path": "",
+        "need_delete": [],
+        "ocr": "",
+        "preview_hits": {},
+        "preview_text": "",
+        "sticker_title": ""
+    }
+
+    # No text predicate runs twice on the same text within one detection
+    glovar.memo.results = {}
+
     try:
         if not message.chat:
             return ""
 
         # Basic data
-        gid = message.chat.id
         uid = message.from_user.id
 
         if not init_user_id(uid):
             return ""
 
-        # Start detect watch ban
-
-        # Check detected records
-        message_content = get_content(message)
-        if message_content:
-            detection = glovar.contents.get(message_content, "")
-            if detection:
-                return detection
-
-        # Work with NOSPAM, check the message's text
-        message_text = get_text(message, True, True)
-        if message_text:
-            if is_ban_text(message_text, False):
-                return ""
-
-        # Bypass
-        message_text = get_text(message)
-        description = get_description(client, gid)
-        if (description and message_text) and message_text in description:
-            return ""
+        # The bypass stages that need API calls can only return "",
+        # so they are checked only when another stage is about to return a detection
+        deferred = []
 
-        pinned_message = get_pinned(client, gid)
-        pinned_content = get_content(pinned_message)
-        if (pinned_content and message_content) and message_content in pinned_content:
-            return ""
+        for stage, cost, veto in watch_stages:
+            if veto and cost == "api":
+                deferred.append(stage)
+                continue
 
-        pinned_text = get_text(pinned_message)
-        if (pinned_text and message_text) and message_text in pinned_text:
-            return ""
+            detection = stage(client, message, context, data)
 
-        # Work with NOSPAM and default LANG, check the forward from name:
-        forward_name = get_forward_name(message)
-        if forward_name:
-            if is_nm_text(forward_name) or is_lang("name", forward_name):
-                return ""
+            if detection is None:
+                continue
 
-        # Check the message's text
-        message_text = get_text(message)
-        if message_text:
-            if is_wb_text(message_text, False) or is_lang("text", message_text):
-                return "ban"
+            if detection and any(bypass(client, message, context, data) == "" for bypass in deferred):
+                detection = ""
 
-        # Check channel restriction
-        if is_restricted_channel(message):
-            return "ban"
+            result = detection
+            break
+    except Exception as e:
+        logger.warning(f"Is watch message error: {e}", exc_info=True)
+    finally:
+        glovar.memo.results = None
 
-        # Check the forward from name
-        if forward_name and forward_name not in glovar.except_ids["long"]:
-            if is_wb_text(forward_name, False) or is_lang("name", forward_name):
-                return "ban"
+        for file in data["need_delete"]:
+            thread(delete_file, (file,))
+
+    return result
 
-        # Check the filename
-        file_name = get_filename(message)
-        if file_name:
-            if is_regex_text("fil", file_name) or is_ban_text(file_name, False):
-                return ""
 
-            if is_wb_text(file_name, False) or is_lang("text", file_name):
-                return "ban"
+def is_watch_user(user: User, the_type: str) -> bool:
+    # Check if the message is sent by a watch user
+    try:
+        uid = user.id
 
-        # Check exe file
-        if is_exe(message):
+        if not glovar.user_ids.get(uid, {}):
+            return False
+
+        if glovar.user_ids[uid]["type"] != the_type:
+            return False
+
+        now = get_now()
+        until = glovar.user_ids[uid]["until"]
+        if now < until:
+            return True
+    except Exception as e:
+        logger.warning(f"Is watch user error: {e}", exc_info=True)
+
+    return False
+
+
+@memoized
+def is_wb_text(text: str, ocr: bool, hits: Dict[str, str] = None) -> bool:
+    # Check if the text is wb text
+    try:
+        if hits is None:
+            hits = get_regex_hits(text, ocr)
+
+        if (hits.get("wb")
+                or hits.get("ad")
+                or hits.get("iml")
+                or hits.get("pho")
+                or hits.get("sho")
+                or hits.get("spc")):
+            return True
+
+        for c in ascii_lowercase:
+            if c not in {"i"} and hits.get(f"ad{c}"):
+                return True
+    except Exception as e:
+        logger.warning(f"Is wb text error: {e}", exc_info=True)
+
+    return False
+
+
+@memoized
+def is_wd_text(text: str, ocr: bool, hits: Dict[str, str] = None) -> bool:
+    # Check if the text is wd text
+    try:
+        if hits is None:
+            hits = get_regex_hits(text, ocr)
+
+        if (hits.get("wd")
+                or hits.get("adi")
+                or hits.get("con")
+                or hits.get("spe")
+                or hits.get("tgp")):
+            return True
+    except Exception as e:
+        logger.warning(f"Is wd text error: {e}", exc_info=True)
+
+    return False
+
+
+def watch_ban_exe(client: Client, message: Message, context: MessageContext, data: Dict[str, Any]) -> Optional[str]:
+    # Check exe file
+    if is_exe(message, context):
+        return "ban"
+
+    return None
+
+
+def watch_ban_file(client: Client, message: Message, context: MessageContext, data: Dict[str, Any]) -> Optional[str]:
+    # Check the filename
+    file_name = context.filename
+
+    if not file_name:
+        return None
+
+    file_hits = get_regex_hits(file_name, False)
+
+    if is_regex_text("fil", file_name) or is_ban_text(file_name, False, hits=file_hits):
+        return ""
+
+    if is_wb_text(file_name, False, file_hits) or is_lang("text", file_name):
+        return "ban"
+
+    return None
+
+
+def watch_ban_forward(client: Client, message: Message, context: MessageContext,
+                      data: Dict[str, Any]) -> Optional[str]:
+    # Check the forward from name
+    forward_name = context.forward_name
+
+    if not forward_name or forward_name in glovar.except_ids["long"]:
+        return None
+
+    if is_wb_text(forward_name, False, get_regex_hits(forward_name, False)) or is_lang("name", forward_name):
+        return "ban"
+
+    return None
+
+
+def watch_ban_image(client: Client, message: Message, context: MessageContext, data: Dict[str, Any]) -> Optional[str]:
+    # Check the image of the message
+    file_id, file_ref, big = context.file_id
+    image_path = big and get_downloaded_path(client, file_id, file_ref)
+    image_path and data["need_delete"].append(image_path)
+    data["image_path"] = image_path
+
+    return get_image_detection(message, context, image_path, data)
+
+
+def watch_ban_preview(client: Client, message: Message, context: MessageContext,
+                      data: Dict[str, Any]) -> Optional[str]:
+    # Check the text of the preview
+    web_page: WebPage = message.web_page
+
+    if not web_page:
+        return None
+
+    preview_text = web_page.display_url + "\n\n"
+
+    if web_page.site_name:
+        preview_text += web_page.site_name + "\n\n"
+
+    if web_page.title:
+        preview_text += web_page.title + "\n\n"
+
+    if web_page.description:
+        preview_text += web_page.description + "\n\n"
+
+    data["preview_text"] = preview_text
+    data["preview_hits"] = get_regex_hits(preview_text, False)
+
+    if is_ban_text(preview_text, False, hits=data["preview_hits"]):
+        return ""
+
+    if is_wb_text(preview_text, False, data["preview_hits"]) or is_lang("text", preview_text):
+        return "ban"
+
+    return None
+
+
+def watch_ban_preview_image(client: Client, message: Message, context: MessageContext,
+                            data: Dict[str, Any]) -> Optional[str]:
+    # Check the image of the preview, skip it under high load
+    web_page: WebPage = message.web_page
+
+    if data["degraded"]:
+        return None
+
+    if not web_page or not web_page.photo or web_page.photo.file_size > glovar.image_size:
+        return None
+
+    image_path = get_downloaded_path(client, web_page.photo.file_id, web_page.photo.file_ref)
+    image_path and data["need_delete"].append(image_path)
+    data["image_path"] = image_path
+
+    return get_image_detection(message, context, image_path, data)
+
+
+def watch_ban_restricted(client: Client, message: Message, context: MessageContext,
+                         data: Dict[str, Any]) -> Optional[str]:
+    # Check channel restriction
+    if is_restricted_channel(message):
+        return "ban"
+
+    return None
+
+
+def watch_ban_sticker(client: Client, message: Message, context: MessageContext,
+                      data: Dict[str, Any]) -> Optional[str]:
+    # Check sticker title
+    sticker_name = message.sticker and message.sticker.set_name
+
+    if not sticker_name:
+        return None
+
+    if sticker_name not in glovar.except_ids["long"]:
+        if is_regex_text("wb", sticker_name):
             return "ban"
 
-        # Check Telegram link
-        if is_tgl(client, message):
-            return "delete"
+    sticker_title = get_sticker_title(client, sticker_name)
+    data["sticker_title"] = sticker_title
 
-        # Check image
-        ocr = ""
-        all_text = ""
+    if is_regex_text("wb", sticker_title) or is_lang("sticker", sticker_title):
+        return f"ban {sticker_title}"
 
-        # Get the image
-        file_id, file_ref, big = get_file_id(message)
-        image_path = big and get_downloaded_path(client, file_id, file_ref)
-        image_path and need_delete.append(image_path)
+    return None
 
-        # Check declared status
-        if is_declared_message(None, None, message):
-            return ""
 
-        # Check hash
-        image_hash = image_path and get_md5sum("file", image_path)
-        if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
-            # Check declare status
-            if is_declared_message(None, None, message):
-                return ""
+def watch_ban_text(client: Client, message: Message, context: MessageContext, data: Dict[str, Any]) -> Optional[str]:
+    # Check the message's text
+    message_text = context.text()
 
-            if big:
-                # Get QR code
-                qrcode = get_qrcode(image_path)
-                if qrcode:
-                    if is_ban_text(qrcode, False):
-                        return ""
+    if not message_text:
+        return None
 
-                    return "ban"
+    if is_wb_text(message_text, False, get_regex_hits(message_text, False)) or is_lang("text", message_text):
+        return "ban"
 
-                # Get OCR
-                ocr = get_ocr(image_path)
-                if ocr:
-                    if is_ban_text(ocr, True):
-                        return ""
+    return None
 
-                    if is_wb_text(ocr, True):
-                        return "ban"
 
-                    if message_text:
-                        all_text = message_text + ocr
-                        if is_ban_text(all_text, False):
-                            return ""
+def watch_bypass_description(client: Client, message: Message, context: MessageContext,
+                             data: Dict[str, Any]) -> Optional[str]:
+    # Bypass the text that is included in the group's description
+    message_text = context.text()
+    description = get_description(client, message.chat.id)
 
-                        if is_wb_text(all_text, False):
-                            return "ban"
+    if (description and message_text) and message_text in description:
+        return ""
 
-        # Check sticker title
-        sticker_title = ""
+    return None
 
-        if message.sticker:
-            sticker_name = message.sticker.set_name
-        else:
-            sticker_name = ""
 
-        if sticker_name:
-            if sticker_name not in glovar.except_ids["long"]:
-                if is_regex_text("wb", sticker_name):
-                    return "ban"
+def watch_bypass_forward(client: Client, message: Message, context: MessageContext,
+                         data: Dict[str, Any]) -> Optional[str]:
+    # Work with NOSPAM and default LANG, check the forward from name
+    forward_name = context.forward_name
 
-            sticker_title = get_sticker_title(client, sticker_name)
-            if is_regex_text("wb", sticker_title) or is_lang("sticker", sticker_title):
-                return f"ban {sticker_title}"
+    if not forward_name:
+        return None
 
-        # Check preview
-        preview_text = ""
+    if is_nm_text(forward_name, get_regex_hits(forward_name, False)) or is_lang("name", forward_name):
+        return ""
 
-        web_page: WebPage = message.web_page
+    return None
 
-        if web_page:
-            preview_text = web_page.display_url + "\n\n"
 
-            if web_page.site_name:
-                preview_text += web_page.site_name + "\n\n"
+def watch_bypass_pinned(client: Client, message: Message, context: MessageContext,
+                        data: Dict[str, Any]) -> Optional[str]:
+    # Bypass the message that is included in the group's pinned message
+    pinned_message = get_pinned(client, message.chat.id)
 
-            if web_page.title:
-                preview_text += web_page.title + "\n\n"
+    message_content = context.content
+    pinned_content = get_content(pinned_message)
 
-            if web_page.description:
-                preview_text += web_page.description + "\n\n"
+    if (pinned_content and message_content) and message_content in pinned_content:
+        return ""
 
-            if is_ban_text(preview_text, False):
-                return ""
+    message_text = context.text()
+    pinned_text = get_text(pinned_message)
 
-            if is_wb_text(preview_text, False) or is_lang("text", preview_text):
-                return "ban"
+    if (pinned_text and message_text) and message_text in pinned_text:
+        return ""
 
-            if web_page.photo and web_page.photo.file_size <= glovar.image_size:
-                # Get the image
-                file_id = web_page.photo.file_id
-                file_ref = web_page.photo.file_ref
-                image_path = get_downloaded_path(client, file_id, file_ref)
-                image_path and need_delete.append(image_path)
+    return None
 
-                # Check declared status
-                if is_declared_message(None, None, message):
-                    return ""
 
-                # Check hash
-                image_hash = image_path and get_md5sum("file", image_path)
-                if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
-                    # Check declare status
-                    if is_declared_message(None, None, message):
-                        return ""
+def watch_bypass_text(client: Client, message: Message, context: MessageContext,
+                      data: Dict[str, Any]) -> Optional[str]:
+    # Work with NOSPAM, check the message's text
+    message_text = context.text(True, True)
 
-                    # Get QR code
-                    qrcode = get_qrcode(image_path)
-                    if qrcode:
-                        if is_ban_text(qrcode, False):
-                            return ""
+    if message_text and is_ban_text(message_text, False):
+        return ""
 
-                        return "ban"
+    return None
 
-                    # Get OCR
-                    ocr = get_ocr(image_path)
-                    if ocr:
-                        if is_ban_text(ocr, True):
-                            return ""
 
-                        if is_wb_text(ocr, True):
-                            return "ban"
+def watch_delete_bypass(client: Client, message: Message, context: MessageContext,
+                        data: Dict[str, Any]) -> Optional[str]:
+    # Start detect watch delete, check if the user is already in watch delete
+    if is_watch_delete(None, None, message):
+        return ""
 
-                        if message_text:
-                            all_text = message_text + ocr
-                            if is_ban_text(all_text, False):
-                                return ""
+    return None
 
-                            if is_wb_text(all_text, False):
-                                return "ban"
 
-        # Start detect watch delete
+def watch_delete_color(client: Client, message: Message, context: MessageContext,
+                       data: Dict[str, Any]) -> Optional[str]:
+    # Check the color of the image
+    if data["image_path"] and get_color(data["image_path"]):
+        return "delete"
 
-        # Check if the user is already in watch delete
-        if is_watch_delete(None, None, message):
-            return ""
+    return None
 
-        # Check detected records
-        if message_content:
-            detection = glovar.contents.get(message_content, "")
-            if detection == "delete":
-                return detection
-
-        # Some media type
-        if (message.animation
-                or message.audio
-                or message.document
-                or message.game
-                or message.location
-                or message.venue
-                or message.via_bot
-                or message.video
-                or message.video_note):
-            return "delete"
-
-        # Forwarded message
-        if message.forward_from or message.forward_sender_name or message.forward_from_chat:
-            return "delete"
-
-        # Check the message's text
-        if message_text:
-            if is_wd_text(message_text, False):
-                return "delete"
-
-        # Check image
-        if ocr:
-            if is_wd_text(message_text, True):
-                return "delete"
-
-        if all_text:
-            if is_wd_text(all_text, False):
-                return "delete"
-
-        if image_path:
-            color = get_color(image_path)
-            if color:
-                return "delete"
-
-        # Check sticker
-        if sticker_title and sticker_title not in glovar.except_ids["long"]:
-            if is_regex_text("wd", sticker_title):
-                return f"delete {sticker_title}"
-
-        # Check preview
-        if preview_text:
-            if is_wd_text(preview_text, False):
-                return "delete"
-
-        if web_page:
-            if (web_page.audio
-                    or web_page.document
-                    or web_page.animation
-                    or web_page.video):
-                return "delete"
-    except Exception as e:
-        logger.warning(f"Is watch message error: {e}", exc_info=True)
-    finally:
-        for file in need_delete:
-            thread(delete_file, (file,))
 
-    return result
+def watch_delete_forward(client: Client, message: Message, context: MessageContext,
+                         data: Dict[str, Any]) -> Optional[str]:
+    # Forwarded message
+    if message.forward_from or message.forward_sender_name or message.forward_from_chat:
+        return "delete"
 
+    return None
 
-def is_watch_user(user: User, the_type: str) -> bool:
-    # Check if the message is sent by a watch user
-    try:
-        uid = user.id
 
-        if not glovar.user_ids.get(uid, {}):
-            return False
+def watch_delete_media(client: Client, message: Message, context: MessageContext,
+                       data: Dict[str, Any]) -> Optional[str]:
+    # Some media type
+    if (message.animation
+            or message.audio
+            or message.document
+            or message.game
+            or message.location
+            or message.venue
+            or message.via_bot
+            or message.video
+            or message.video_note):
+        return "delete"
 
-        if glovar.user_ids[uid]["type"] != the_type:
-            return False
+    return None
 
-        now = get_now()
-        until = glovar.user_ids[uid]["until"]
-        if now < until:
-            return True
-    except Exception as e:
-        logger.warning(f"Is watch user error: {e}", exc_info=True)
 
-    return False
+def watch_delete_preview(client: Client, message: Message, context: MessageContext,
+                         data: Dict[str, Any]) -> Optional[str]:
+    # Check the media of the preview
+    web_page: WebPage = message.web_page
 
+    if web_page and (web_page.audio
+                     or web_page.document
+                     or web_page.animation
+                     or web_page.video):
+        return "delete"
 
-def is_wb_text(text: str, ocr: bool) -> bool:
-    # Check if the text is wb text
-    try:
-        if (is_regex_text("wb", text, ocr)
-                or is_regex_text("ad", text, ocr)
-                or is_regex_text("iml", text, ocr)
-                or is_regex_text("pho", text, ocr)
-                or is_regex_text("sho", text, ocr)
-                or is_regex_text("spc", text, ocr)):
-            return True
+    return None
 
-        for c in ascii_lowercase:
-            if c not in {"i"} and is_regex_text(f"ad{c}", text, ocr):
-                return True
-    except Exception as e:
-        logger.warning(f"Is wb text error: {e}", exc_info=True)
 
-    return False
+def watch_delete_preview_text(client: Client, message: Message, context: MessageContext,
+                              data: Dict[str, Any]) -> Optional[str]:
+    # Check the text of the preview
+    if data["preview_text"] and is_wd_text(data["preview_text"], False, data["preview_hits"]):
+        return "delete"
 
+    return None
 
-def is_wd_text(text: str, ocr: bool) -> bool:
-    # Check if the text is wd text
-    try:
-        if (is_regex_text("wd", text, ocr)
-                or is_regex_text("adi", text, ocr)
-                or is_regex_text("con", text, ocr)
-                or is_regex_text("spe", text, ocr)
-                or is_regex_text("tgp", text, ocr)):
-            return True
-    except Exception as e:
-        logger.warning(f"Is wd text error: {e}", exc_info=True)
 
-    return False
+def watch_delete_record(client: Client, message: Message, context: MessageContext,
+                        data: Dict[str, Any]) -> Optional[str]:
+    # Check detected records
+    if context.content and glovar.contents.get(context.content, "") == "delete":
+        return "delete"
+
+    return None
+
+
+def watch_delete_sticker(client: Client, message: Message, context: MessageContext,
+                         data: Dict[str, Any]) -> Optional[str]:
+    # Check the title of the sticker
+    sticker_title = data["sticker_title"]
+
+    if sticker_title and sticker_title not in glovar.except_ids["long"]:
+        if is_regex_text("wd", sticker_title):
+            return f"delete {sticker_title}"
+
+    return None
+
+
+def watch_delete_text(client: Client, message: Message, context: MessageContext,
+                      data: Dict[str, Any]) -> Optional[str]:
+    # Check the message's text and the text of the image
+    message_text = context.text()
+
+    if message_text and is_wd_text(message_text, False, get_regex_hits(message_text, False)):
+        return "delete"
+
+    if data["ocr"] and is_wd_text(message_text, True):
+        return "delete"
+
+    if data["all_text"] and is_wd_text(data["all_text"], False, data["all_hits"]):
+        return "delete"
+
+    return None
+
+
+def watch_record(client: Client, message: Message, context: MessageContext, data: Dict[str, Any]) -> Optional[str]:
+    # Check detected records
+    detection = context.content and glovar.contents.get(context.content, "")
+
+    return detection or None
+
+
+def watch_tgl(client: Client, message: Message, context: MessageContext, data: Dict[str, Any]) -> Optional[str]:
+    # Check Telegram link
+    if is_tgl(client, message, context=context):
+        return "delete"
+
+    return None
+
+
+# The stages of is_watch_message, with the cost of each stage and whether it can only return "",
+# a stage returns None to continue, or the detection to stop.
+# The order of the stages decides the verdict, so a stage is only moved ahead of the stages that return the same
+# detection, the cheap ones first
+watch_stages: List[Tuple[Callable, str, bool]] = [
+    # Start detect watch ban
+    (watch_record, "cheap", False),
+    (watch_bypass_text, "regex", True),
+    (watch_bypass_description, "api", True),
+    (watch_bypass_pinned, "api", True),
+    (watch_bypass_forward, "regex", True),
+    (watch_ban_restricted, "cheap", False),
+    (watch_ban_forward, "regex", False),
+    (watch_ban_text, "regex", False),
+    (watch_ban_file, "regex", False),
+    (watch_ban_exe, "cheap", False),
+    (watch_tgl, "api", False),
+    (watch_ban_image, "media", False),
+    (watch_ban_sticker, "api", False),
+    (watch_ban_preview, "regex", False),
+    (watch_ban_preview_image, "media", False),
+    # Start detect watch delete
+    (watch_delete_bypass, "cheap", True),
+    (watch_delete_record, "cheap", False),
+    (watch_delete_media, "cheap", False),
+    (watch_delete_forward, "cheap", False),
+    (watch_delete_text, "regex", False),
+    (watch_delete_color, "media", False),
+    (watch_delete_sticker, "regex", False),
+    (watch_delete_preview, "cheap", False),
+    (watch_delete_preview_text, "regex", False)
+]
@@ -26,6 +26,22 @@ from .file import save
 logger = logging.getLogger(__name__)
 
 
+def add_except_content(the_type: str, content: str) -> bool:
+    # Add a content to the except list, the exchange data changes the list under the same lock
+    glovar.locks["receive"].acquire()
+    try:
+        glovar.except_ids[the_type].add(content)
+        save("except_ids")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add except content error: {e}", exc_info=True)
+    finally:
+        glovar.locks["receive"].release()
+
+    return False
+
+
 def init_group_id(gid: int) -> bool:
     # Init group data
     try:
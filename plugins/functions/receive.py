@@ -18,26 +18,87 @@
 
 import logging
 import pickle
+from collections import deque
 from copy import deepcopy
 from json import loads
 from subprocess import run, PIPE
-from typing import Any
+from time import perf_counter
+from typing import Any, Union
 
 from pyrogram import Client
 from pyrogram.types import Message
 
 from .. import glovar
-from .channel import get_content, send_help, share_data
-from .etc import code, crypt_str, general_link, get_int, get_now, get_readable_time, get_report_record, get_text, lang
-from .etc import mention_id, thread
-from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
+from .channel import get_content, send_help, send_quarantine, share_data
+from .etc import code, crypt_str, general_link, get_int, get_memo_rate, get_now, get_queue_depth, get_readable_time
+from .etc import get_report_record, get_schedule_latency, get_text, get_user_lock, lang, lock_users, mention_id
+from .etc import reset_verdicts, thread
+from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save, set_data
+from .filters import get_forms
 from .group import get_message
 from .ids import init_group_id, init_user_id
+from .timers import flush_count
+from .words import get_compiled, get_matched_forms, get_ordered, get_special
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def check_shadows(client: Client, stopping: bool = False) -> bool:
+    # Evaluate the rule updates in shadow mode with the sampled texts, apply the updates that are evaluated
+    try:
+        # The pending updates are applied at once when the program is stopping
+        if stopping:
+            glovar.stopping = True
+
+        for word_type, shadow in list(glovar.shadows.items()):
+            # The new rules are still being compiled
+            if shadow["compiled"] is None:
+                continue
+
+            while shadow["samples"] and shadow["count"] < glovar.limit_shadow and not glovar.stopping:
+                text, ocr = shadow["samples"].popleft()
+                forms = get_forms(text)
+
+                begin = perf_counter()
+                word_old, _ = get_matched_forms(glovar.compiled.get(word_type, {}), forms, ocr, glovar.time_regex)
+                shadow["time_old"] += perf_counter() - begin
+
+                begin = perf_counter()
+                word_new, _ = get_matched_forms(shadow["compiled"], forms, ocr, glovar.time_regex, shadow["timeouts"])
+                shadow["time_new"] += perf_counter() - begin
+
+                shadow["count"] += 1
+                shadow["diffs"] += bool(word_old) != bool(word_new)
+
+            if (shadow["count"] >= glovar.limit_shadow
+                    or get_now() - shadow["start"] >= glovar.time_shadow
+                    or glovar.stopping):
+                update_regex(client, word_type, shadow)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Check shadows error: {e}", exc_info=True)
+
+    return False
+
+
+def compile_shadow(client: Client, word_type: str, shadow: dict) -> bool:
+    # Compile the new rules of the rule update in shadow mode without blocking the live ones
+    try:
+        words = get_ordered(shadow["data"], glovar.rates.get(word_type, {}))
+        shadow["compiled"] = get_compiled(words, glovar.compiled.get(word_type))
+
+        # The last check of the timer may be passed during the compilation
+        glovar.stopping and update_regex(client, word_type, shadow)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Compile shadow error: {e}", exc_info=True)
+
+    return False
+
+
 def receive_add_bad(sender: str, data: dict) -> bool:
     # Receive bad users or channels that other bots shared
     try:
@@ -110,7 +171,7 @@ def receive_add_except(client: Client, data: dict) -> bool:
 
 def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
     # Receive clear data command
-    glovar.locks["message"].acquire()
+    lock_users("acquire")
     try:
         # Basic data
         aid = data["admin_id"]
@@ -173,7 +234,7 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
     except Exception as e:
         logger.warning(f"Receive clear data: {e}", exc_info=True)
     finally:
-        glovar.locks["message"].release()
+        lock_users("release")
 
     return False
 
@@ -230,9 +291,53 @@ def receive_file_data(client: Client, message: Message, decrypt: bool = True) ->
     return data
 
 
+def receive_profile_ask(client: Client, sender: str, data: Union[dict, str]) -> bool:
+    # Receive regex profile request
+    try:
+        flush_count()
+
+        # Sort the rules by the cumulative time
+        with glovar.locks["regex"]:
+            profiles = {}
+
+            for word_type in glovar.profiles:
+                records = sorted(glovar.profiles[word_type].items(), key=lambda item: -item[1][0])
+                profiles[word_type] = {word: {"time": record[0], "calls": record[1], "hits": record[2]}
+                                       for word, record in records}
+
+        file = data_to_file(profiles)
+
+        if sender == "MANAGE":
+            share_data(
+                client=client,
+                receivers=["MANAGE"],
+                action="profile",
+                action_type="reply",
+                data={
+                    "admin_id": data["admin_id"],
+                    "message_id": data["message_id"]
+                },
+                file=file
+            )
+        else:
+            share_data(
+                client=client,
+                receivers=["REGEX"],
+                action="regex",
+                action_type="profile",
+                data="profile",
+                file=file
+            )
+
+        return True
+    except Exception as e:
+        logger.warning(f"Receive profile ask error: {e}", exc_info=True)
+
+    return False
+
+
 def receive_regex(client: Client, message: Message, data: str) -> bool:
     # Receive regex
-    glovar.locks["regex"].acquire()
     try:
         file_name = data
         word_type = file_name.split("_")[0]
@@ -243,39 +348,24 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
         if not words_data:
             return True
 
-        pop_set = set(eval(f"glovar.{file_name}")) - set(words_data)
-        new_set = set(words_data) - set(eval(f"glovar.{file_name}"))
-        for word in pop_set:
-            eval(f"glovar.{file_name}").pop(word, 0)
-
-        for word in new_set:
-            eval(f"glovar.{file_name}")[word] = 0
-
-        save(file_name)
-
-        # Regenerate special characters dictionary if possible
-        if file_name in {"spc_words", "spe_words"}:
-            special = file_name.split("_")[0]
-            exec(f"glovar.{special}_dict = {{}}")
-            for rule in words_data:
-                # Check keys
-                if "[" not in rule:
-                    continue
-
-                # Check value
-                if "?#" not in rule:
-                    continue
-
-                keys = rule.split("]")[0][1:]
-                value = rule.split("?#")[1][1]
-                for k in keys:
-                    eval(f"glovar.{special}_dict")[k] = value
+        # Compile the new rules in the background, check_shadows evaluates them, a newer update replaces the pending one
+        shadow = {
+            "compiled": None,
+            "count": 0,
+            "data": words_data,
+            "diffs": 0,
+            "samples": deque(maxlen=glovar.limit_shadow),
+            "start": get_now(),
+            "time_new": 0.0,
+            "time_old": 0.0,
+            "timeouts": []
+        }
+        glovar.shadows[word_type] = shadow
+        thread(compile_shadow, (client, word_type, shadow), queue="regex")
 
         return True
     except Exception as e:
         logger.warning(f"Receive regex error: {e}", exc_info=True)
-    finally:
-        glovar.locks["regex"].release()
 
     return False
 
@@ -354,7 +444,8 @@ def receive_remove_except(client: Client, data: dict) -> bool:
 
 def receive_remove_score(data: int) -> bool:
     # Receive remove user's score
-    glovar.locks["message"].acquire()
+    lock = get_user_lock(data)
+    lock.acquire()
     try:
         # Basic data
         uid = data
@@ -369,7 +460,7 @@ def receive_remove_score(data: int) -> bool:
     except Exception as e:
         logger.warning(f"Receive remove score error: {e}", exc_info=True)
     finally:
-        glovar.locks["message"].release()
+        lock.release()
 
     return False
 
@@ -402,9 +493,24 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
-        exec(f"glovar.{the_type} = the_data")
+        set_data(the_type, the_data)
         save(the_type)
 
+        # Recompile the rules if the words are rolled back
+        word_type = the_type.split("_")[0]
+        if the_type == f"{word_type}_words" and word_type in glovar.regex:
+            # Drop the pending update
+            glovar.shadows.pop(word_type, {})
+
+            with glovar.locks["regex"]:
+                words = get_ordered(the_data, glovar.rates.get(word_type, {}), glovar.quarantine.get(word_type, set()))
+                glovar.compiled[word_type] = get_compiled(words, glovar.compiled.get(word_type))
+
+                if word_type in glovar.special_dicts:
+                    glovar.special_dicts[word_type] = get_special(the_data)
+
+                reset_verdicts()
+
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
@@ -419,8 +525,7 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
 
 def receive_status_ask(client: Client, data: dict) -> bool:
     # Receive version info request
-    glovar.locks["text"].acquire()
-    glovar.locks["message"].acquire()
+    lock_users("acquire")
     try:
         # Basic data
         aid = data["admin_id"]
@@ -455,7 +560,10 @@ def receive_status_ask(client: Client, data: dict) -> bool:
             lang("suggest_ban"): f"{ban_count} {lang('members')}",
             lang("suggest_delete"): f"{delete_count} {lang('members')}",
             lang("track_ban"): f"{pending_ban_count} {lang('members')}",
-            lang("track_delete"): f"{pending_delete_count} {lang('members')}"
+            lang("track_delete"): f"{pending_delete_count} {lang('members')}",
+            lang("memo_rate"): get_memo_rate(),
+            lang("queue_depth"): get_queue_depth(),
+            lang("schedule_latency"): get_schedule_latency()
         }
         file = data_to_file(status)
         share_data(
@@ -474,8 +582,7 @@ def receive_status_ask(client: Client, data: dict) -> bool:
     except Exception as e:
         logger.warning(f"Receive version ask error: {e}", exc_info=True)
     finally:
-        glovar.locks["text"].release()
-        glovar.locks["message"].release()
+        lock_users("release")
 
     return False
 
@@ -498,7 +605,8 @@ def receive_text_data(message: Message) -> dict:
 
 def receive_user_score(project: str, data: dict) -> bool:
     # Receive and update user's score
-    glovar.locks["message"].acquire()
+    lock = get_user_lock(data["id"])
+    lock.acquire()
     try:
         # Basic data
         project = project.lower()
@@ -515,7 +623,7 @@ def receive_user_score(project: str, data: dict) -> bool:
     except Exception as e:
         logger.warning(f"Receive user score error: {e}", exc_info=True)
     finally:
-        glovar.locks["message"].release()
+        lock.release()
 
     return False
 
@@ -580,3 +688,80 @@ def receive_watch_user(data: dict) -> bool:
         logger.warning(f"Receive watch user error: {e}", exc_info=True)
 
     return False
+
+
+def update_regex(client: Client, word_type: str, shadow: dict) -> bool:
+    # Update the rules of the word type after evaluating them in shadow mode
+    try:
+        # A newer update is received, or the update is applied already
+        with glovar.locks["shadow"]:
+            if glovar.shadows.get(word_type) is not shadow:
+                return True
+
+            glovar.shadows.pop(word_type, {})
+
+        words_data = shadow["data"]
+        compiled = shadow["compiled"]
+        samples = shadow["count"]
+        diffs = shadow["diffs"]
+        time_old = shadow["time_old"]
+        time_new = shadow["time_new"]
+
+        # Exclude the new rules that are timed out repeatedly in shadow mode
+        counts = {}
+
+        for word in shadow["timeouts"]:
+            counts[word] = counts.get(word, 0) + 1
+
+        quarantined = {word for word, count in counts.items() if count >= glovar.limit_timeout}
+
+        if quarantined:
+            words = get_ordered(words_data, glovar.rates.get(word_type, {}), quarantined)
+            compiled = get_compiled(words, compiled)
+
+        # Swap the rules
+        with glovar.locks["regex"]:
+            words = glovar.words[word_type]
+            pop_set = set(words) - set(words_data)
+            new_set = set(words_data) - set(words)
+            for word in pop_set:
+                words.pop(word, 0)
+
+            for word in new_set:
+                words[word] = 0
+
+            save(f"{word_type}_words")
+
+            # Give the quarantined rules another chance, except the ones timed out in shadow mode
+            glovar.quarantine[word_type] = quarantined
+            glovar.timeout_counts[word_type] = counts
+
+            # Publish the new snapshot
+            glovar.compiled[word_type] = compiled
+
+            # Regenerate special characters dictionary if possible
+            if word_type in glovar.special_dicts:
+                glovar.special_dicts[word_type] = get_special(words_data)
+
+            # The cached verdicts are out of date
+            reset_verdicts()
+
+        # Send debug message
+        time_text = (f"{time_old / (samples or 1) * 1000:.3f} ms -> "
+                     f"{time_new / (samples or 1) * 1000:.3f} ms")
+        text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                f"{lang('action')}{lang('colon')}{code(lang('rule_update'))}\n"
+                f"{lang('shadow_samples')}{lang('colon')}{code(samples)}\n"
+                f"{lang('shadow_diffs')}{lang('colon')}{code(diffs)}\n"
+                f"{lang('shadow_time')}{lang('colon')}{code(time_text)}\n"
+                f"{lang('more')}{lang('colon')}{code(f'{word_type}_words')}\n")
+        thread(send_help, (client, glovar.debug_channel_id, text))
+
+        for word in quarantined:
+            send_quarantine(client, word_type, word)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update regex error: {e}", exc_info=True)
+
+    return False
@@ -17,14 +17,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from time import sleep
+from time import sleep, time
 
 from pyrogram import Client
 
 from .. import glovar
-from .channel import send_help, share_data, share_regex_count
-from .etc import code, general_link, get_now, lang, thread
-from .file import save
+from .channel import send_help, send_quarantine, share_data, share_regex_count
+from .etc import code, general_link, get_now, lang, lock_users, reset_verdicts, thread
+from .file import get_data, save
+from .user import terminate_album
+from .words import get_compiled, get_ordered
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -35,7 +37,7 @@ def backup_files(client: Client) -> bool:
     try:
         for file in glovar.file_list:
             # Check
-            if not eval(f"glovar.{file}"):
+            if not get_data(file):
                 continue
 
             # Share
@@ -56,10 +58,146 @@ def backup_files(client: Client) -> bool:
     return False
 
 
+def check_albums(client: Client) -> bool:
+    # Check the albums whose collection window is over
+    try:
+        now = get_now()
+
+        with glovar.locks["album"]:
+            mids = [mid for mid, album in glovar.albums.items() if now - album["time"] >= glovar.time_album]
+            albums = [glovar.albums.pop(mid)["messages"] for mid in mids]
+
+        for messages in albums:
+            thread(terminate_album, (client, messages), queue="album")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Check albums error: {e}", exc_info=True)
+
+    return False
+
+
+def check_load(client: Client) -> bool:
+    # Enter or leave the degraded mode by the pending updates and the longest waiting time
+    try:
+        now = time()
+
+        with glovar.locks["schedule"]:
+            waiting = len(glovar.schedule["waiting"])
+            latency = max((now - entry[2] for entry in glovar.schedule["waiting"]), default=0.0)
+
+        # The updates that no Pyrogram worker has taken yet are the real backlog,
+        # the waiting handlers are limited by the workers
+        waiting += client.dispatcher.updates_queue.qsize()
+
+        # Leave the degraded mode only when the load is well below the limits
+        if glovar.load["degraded"]:
+            degraded = waiting > glovar.limit_load / 2 or latency > glovar.time_load / 2
+        else:
+            degraded = waiting >= glovar.limit_load or latency >= glovar.time_load
+
+        if degraded == glovar.load["degraded"]:
+            return True
+
+        glovar.load["degraded"] = degraded
+        update_status(client, (degraded and "degraded") or "awake")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Check load error: {e}", exc_info=True)
+
+    return False
+
+
+def check_timeout(client: Client) -> bool:
+    # Quarantine the rules that are timed out repeatedly
+    glovar.locks["regex"].acquire()
+    try:
+        quarantined = []
+
+        while glovar.timeouts:
+            word_type, word = glovar.timeouts.popleft()
+
+            # The rule may be removed or quarantined already
+            if word not in glovar.words.get(word_type, {}) or word in glovar.quarantine.get(word_type, set()):
+                continue
+
+            counts = glovar.timeout_counts.setdefault(word_type, {})
+            counts[word] = counts.get(word, 0) + 1
+
+            if counts[word] < glovar.limit_timeout:
+                continue
+
+            glovar.quarantine.setdefault(word_type, set()).add(word)
+            quarantined.append((word_type, word))
+
+        # Exclude the rules until the next update from REGEX
+        for word_type in {word_type for word_type, _ in quarantined}:
+            words = get_ordered(glovar.words[word_type], glovar.rates.get(word_type, {}),
+                                glovar.quarantine[word_type])
+            glovar.compiled[word_type] = get_compiled(words, glovar.compiled.get(word_type))
+            reset_verdicts()
+
+        # Send debug message
+        for word_type, word in quarantined:
+            send_quarantine(client, word_type, word)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Check timeout error: {e}", exc_info=True)
+    finally:
+        glovar.locks["regex"].release()
+
+    return False
+
+
+def flush_count() -> bool:
+    # Save the pending regex hit counts to the words data, and merge the profile records
+    glovar.locks["regex"].acquire()
+    try:
+        changed = set()
+
+        while glovar.counts:
+            word_type, word = glovar.counts.popleft()
+            words = glovar.words[word_type]
+
+            # The rule may be removed by REGEX already
+            if word not in words:
+                continue
+
+            words[word] += 1
+            rates = glovar.rates.setdefault(word_type, {})
+            rates[word] = rates.get(word, 0.0) + 1
+            changed.add(word_type)
+
+        for word_type in changed:
+            save(f"{word_type}_words")
+
+        changed and save("rates")
+
+        # Merge the profile records
+        while glovar.profile_records:
+            word_type, profile = glovar.profile_records.popleft()
+            profiles = glovar.profiles.setdefault(word_type, {})
+
+            for word, record in profile.items():
+                total = profiles.setdefault(word, [0.0, 0, 0])
+                total[0] += record[0]
+                total[1] += record[1]
+                total[2] += record[2]
+
+        return True
+    except Exception as e:
+        logger.warning(f"Flush count error: {e}", exc_info=True)
+    finally:
+        glovar.locks["regex"].release()
+
+    return False
+
+
 def interval_hour_01() -> bool:
     # Execute every hour
-    glovar.locks["text"].acquire()
-    glovar.locks["message"].acquire()
+    lock_users("acquire")
     try:
         # Delete user data
         now = get_now()
@@ -81,8 +219,7 @@ def interval_hour_01() -> bool:
     except Exception as e:
         logger.warning(f"Interval hour 01 error: {e}", exc_info=True)
     finally:
-        glovar.locks["text"].release()
-        glovar.locks["message"].release()
+        lock_users("release")
 
     return False
 
@@ -90,14 +227,21 @@ def interval_hour_01() -> bool:
 def reset_data(client: Client) -> bool:
     # Reset user data every month
     try:
-        glovar.bad_ids["users"] = set()
-        save("bad_ids")
+        # Take the locks in the order of the exchange data
+        with glovar.locks["receive"]:
+            glovar.bad_ids["users"] = set()
+            save("bad_ids")
 
-        glovar.except_ids["temp"] = set()
-        save("except_ids")
+            glovar.except_ids["temp"] = set()
+            save("except_ids")
 
-        glovar.user_ids = {}
-        save("user_ids")
+            lock_users("acquire")
+
+            try:
+                glovar.user_ids = {}
+                save("user_ids")
+            finally:
+                lock_users("release")
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
@@ -113,21 +257,62 @@ def reset_data(client: Client) -> bool:
 
 def send_count(client: Client) -> bool:
     # Send regex count to REGEX
-    glovar.locks["regex"].acquire()
     try:
-        for word_type in glovar.regex:
-            share_regex_count(client, word_type)
-            word_list = list(eval(f"glovar.{word_type}_words"))
-            for word in word_list:
-                eval(f"glovar.{word_type}_words")[word] = 0
+        flush_count()
 
-            save(f"{word_type}_words")
+        # Take the counts and reset them, the sending does not need the lock
+        counts = {}
+
+        with glovar.locks["regex"]:
+            for word_type in glovar.regex:
+                words = glovar.words[word_type]
+                counts[word_type] = dict(words)
+
+                for word in words:
+                    words[word] = 0
+
+                save(f"{word_type}_words")
+
+                # Decay the hit rates instead of resetting them, forget the removed rules
+                rates = glovar.rates.setdefault(word_type, {})
+
+                for word in list(rates):
+                    if word in words and rates[word] * glovar.rate_decay >= 0.01:
+                        rates[word] *= glovar.rate_decay
+                    else:
+                        rates.pop(word, 0.0)
+
+            save("rates")
+
+        for word_type in counts:
+            share_regex_count(client, word_type, counts[word_type])
 
         return True
     except Exception as e:
         logger.warning(f"Send count error: {e}", exc_info=True)
-    finally:
-        glovar.locks["regex"].release()
+
+    return False
+
+
+def sort_words() -> bool:
+    # Sort the rules of each type by the hit rates
+    try:
+        flush_count()
+
+        with glovar.locks["regex"]:
+            for word_type in glovar.regex:
+                words = get_ordered(glovar.words[word_type], glovar.rates.get(word_type, {}),
+                                    glovar.quarantine.get(word_type, set()))
+                compiled = glovar.compiled.get(word_type)
+
+                if compiled and list(compiled["order"]) == [w for w in words if w in compiled["patterns"]]:
+                    continue
+
+                glovar.compiled[word_type] = get_compiled(words, compiled)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Sort words error: {e}", exc_info=True)
 
     return False
 
@@ -142,7 +327,8 @@ def update_status(client: Client, the_type: str) -> bool:
             action_type="status",
             data={
                 "type": the_type,
-                "backup": glovar.backup
+                "backup": glovar.backup,
+                "degraded": glovar.load["degraded"]
             }
         )
 
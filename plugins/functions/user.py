@@ -17,21 +17,41 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from typing import List
 
 from pyrogram import Client
 from pyrogram.types import Message, User
 
 from .. import glovar
 from .channel import forward_evidence, share_watch_user
-from .etc import crypt_str, get_now, lang
+from .context import MessageContext, get_context
+from .decorators import scheduled
+from .etc import crypt_str, get_now, get_user_lock, lang
 from .file import save
-from .filters import is_class_d, is_declared_message, is_watch_user
+from .filters import is_class_d, is_declared_message, is_watch_album, is_watch_user
 from .ids import init_user_id
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def add_album(client: Client, message: Message) -> bool:
+    # Collect the messages of an album, the album is checked as one unit by check_albums after the collection window
+    try:
+        # Basic data
+        mid = message.media_group_id
+
+        with glovar.locks["album"]:
+            album = glovar.albums.setdefault(mid, {"messages": [], "time": get_now()})
+            album["messages"].append(message)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add album error: {e}", exc_info=True)
+
+    return False
+
+
 def add_watch_count(the_type: str, gid: int, user: User) -> bool:
     # Change a user's watch count
     try:
@@ -44,7 +64,7 @@ def add_watch_count(the_type: str, gid: int, user: User) -> bool:
 
         glovar.user_ids[uid][the_type][gid] = now
 
-        if len(glovar.user_ids[uid][the_type]) < eval(f"glovar.limit_{the_type}"):
+        if len(glovar.user_ids[uid][the_type]) < getattr(glovar, f"limit_{the_type}"):
             save("user_ids")
             return False
 
@@ -93,7 +113,43 @@ def add_watch_user(client: Client, the_type: str, uid: int, mid: int) -> bool:
     return False
 
 
-def terminate_user(client: Client, message: Message, the_type: str) -> bool:
+@scheduled("detect")
+def terminate_album(client: Client, messages: List[Message]) -> bool:
+    # Check the album, the album gets one verdict, one evidence and one watch count
+    try:
+        if not messages:
+            return True
+
+        # The messages of the album are sent by the same user
+        with get_user_lock(messages[0].from_user.id):
+            contexts = [get_context(message) for message in messages]
+            detections = is_watch_album(client, messages, contexts)
+
+            # The ban detection is more severe than the delete detection
+            levels = [detection.split()[0] if detection else "" for detection in detections]
+            level = ("ban" in levels and "ban") or ("delete" in levels and "delete")
+
+            if not level:
+                return True
+
+            index = levels.index(level)
+            result = terminate_user(client, messages[index], detections[index], contexts[index])
+
+            if not result:
+                return True
+
+            for context, detection in zip(contexts, detections):
+                if context.content and detection:
+                    glovar.contents[context.content] = detection
+
+        return True
+    except Exception as e:
+        logger.warning(f"Terminate album error: {e}", exc_info=True)
+
+    return False
+
+
+def terminate_user(client: Client, message: Message, the_type: str, context: MessageContext = None) -> bool:
     # Add user to watch list
     try:
         # Check if it is necessary
@@ -119,7 +175,8 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
             client=client,
             message=message,
             level=lang(the_type),
-            more=sticker_title
+            more=sticker_title,
+            context=context
         )
         if result:
             add_watch_user(client, the_type, uid, result.message_id)
@@ -0,0 +1,443 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sre_parse
+from bisect import bisect_right
+from itertools import chain
+from time import perf_counter
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Match, Optional, Pattern, Tuple
+
+import regex
+from ahocorasick import Automaton
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# This module is also imported by glovar while it loads the data,
+# so it should never import glovar or other functions modules
+
+# The compiled rules are read-only snapshots, a new snapshot is swapped in when the rules change,
+# so the readers can take a reference without any lock
+
+# Rules that use these features depend on their own group numbers or global flags,
+# they can not be joined into one alternation safely
+separate_pattern = regex.compile(r"\\[1-9]|\\g<|\(\?(?:P?<[a-zA-Z_]|P[=>]|[&|(R]|[+-]?\d|[a-zA-Z]+\))")
+
+# Rules that use these features are parsed differently by the re module,
+# the literals extracted from them can not be trusted
+unparsed_pattern = regex.compile(r"\{(?!\d*,?\d*\})|\[\[|\[:")
+
+# Rules that contain these comments do not apply to the OCR text or the whitespace-stripped text
+nocr_mark = "(?# nocr)"
+nostrip_mark = "(?# nostrip)"
+
+# The re module treats the dotless i and the dotted capital I as case variants of i, the regex module does not,
+# so the rules and the texts are folded to keep the rules matching as they did
+fold_table = str.maketrans({"\u0131": "i", "\u0130": "i"})
+
+# The compiled rules of a process pool worker
+pool_compiled: Dict[str, Dict[str, Any]] = {}
+
+
+def get_automaton(literals: Dict[str, str]) -> Optional[Automaton]:
+    # Get the Aho-Corasick automaton of the literals
+    result = None
+
+    try:
+        automaton = Automaton()
+        rules = {}
+
+        for word, literal in literals.items():
+            literal and rules.setdefault(literal, []).append(word)
+
+        if not rules:
+            return None
+
+        for literal, word_list in rules.items():
+            automaton.add_word(literal, word_list)
+
+        automaton.make_automaton()
+        result = automaton
+    except Exception as e:
+        logger.warning(f"Get automaton error: {e}", exc_info=True)
+
+    return result
+
+
+def get_candidates(view: Dict[str, Any], order: Dict[str, int], text: str) -> Iterable[str]:
+    # Get the indexed rules whose required literal appears in the text
+    result = []
+
+    try:
+        if not view["automaton"]:
+            return []
+
+        folded = text.casefold()
+
+        # Case folding changed the length, the literals may not be found as expected
+        if len(folded) != len(text):
+            return view["indexed"]
+
+        found = set()
+
+        for _, word_list in view["automaton"].iter(folded):
+            found.update(word_list)
+
+        result = sorted(found, key=order.get)
+    except Exception as e:
+        logger.warning(f"Get candidates error: {e}", exc_info=True)
+        result = view["indexed"]
+
+    return result
+
+
+def get_compiled(words: Iterable[str], compiled: Dict[str, Any] = None) -> Dict[str, Any]:
+    # Get the compiled snapshot of a word type, reuse the old patterns if possible
+    return get_frozen(get_rules(words, compiled))
+
+
+def get_folded(text: str) -> str:
+    # Fold the variants of i in the rule or the text
+    return text.translate(fold_table)
+
+
+def get_frozen(compiled: Dict[str, Any]) -> Dict[str, Any]:
+    # Get a read-only copy of the compiled rules
+    result = {}
+
+    for key, value in compiled.items():
+        if isinstance(value, dict):
+            result[key] = get_frozen(value)
+        elif isinstance(value, list):
+            result[key] = tuple(value)
+        else:
+            result[key] = value
+
+    return MappingProxyType(result)
+
+
+def get_literal(word: str) -> str:
+    # Get the longest literal that must appear in any text matched by the rule
+    result = ""
+
+    try:
+        if unparsed_pattern.search(word):
+            return ""
+
+        literals = []
+        get_literals(sre_parse.parse(word), literals)
+        literals = [get_folded(literal) for literal in literals]
+        literals = [literal.casefold() for literal in literals if len(literal.casefold()) == len(literal)]
+
+        if not literals:
+            return ""
+
+        result = max(literals, key=len)
+
+        # Too short to skip anything
+        if len(result) < 2:
+            result = ""
+    except Exception as e:
+        logger.info(f"Get literal of {word} error: {e}")
+
+    return result
+
+
+def get_literals(items: Iterable, literals: List[str]) -> bool:
+    # Collect the required literal runs of the parsed items
+    run = ""
+
+    for code, av in items:
+        if code == sre_parse.LITERAL:
+            run += chr(av)
+            continue
+
+        run and literals.append(run)
+        run = ""
+
+        if code in {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT} and av[0] >= 1:
+            get_literals(av[2], literals)
+        elif code == sre_parse.SUBPATTERN:
+            get_literals(av[-1], literals)
+
+    run and literals.append(run)
+
+    return True
+
+
+def get_marked(word: str, ocr: bool, stripped: bool) -> bool:
+    # Check if the rule declares that it does not apply to the form of the text
+    return (ocr and nocr_mark in word) or (stripped and nostrip_mark in word)
+
+
+def get_matched(compiled: Dict[str, Any], text: str, ocr: bool = False, stripped: bool = False,
+                timeout: float = None, timeouts: List[str] = None,
+                profile: Dict[str, List] = None) -> Tuple[str, Optional[Match]]:
+    # Get the first rule that matches the text, and the match object, the timed out rules are added to timeouts
+    try:
+        if not compiled:
+            return "", None
+
+        # The view only has the rules that apply to the form of the text
+        view = compiled["views"][(ocr, stripped)]
+        candidates = get_candidates(view, compiled["order"], text)
+
+        # Check the rules one by one to record the time, call count and hit count of each rule
+        if profile is not None:
+            for word in chain(candidates, view["words"], view["separate"]):
+                start = perf_counter()
+                result = get_search(compiled["patterns"][word], text, timeout, word, timeouts)
+                record = profile.setdefault(word, [0.0, 0, 0])
+                record[0] += perf_counter() - start
+                record[1] += 1
+                record[2] += bool(result)
+
+                if result:
+                    return word, result
+
+            return "", None
+
+        # Check the rules whose literal is found in the text
+        for word in candidates:
+            result = get_search(compiled["patterns"][word], text, timeout, word, timeouts)
+
+            if result:
+                return word, result
+
+        # Scan the text once for all the joined rules
+        words = view["separate"]
+
+        try:
+            if view["combined"]:
+                result = view["combined"].search(text, timeout=timeout)
+
+                if result:
+                    word = view["words"][bisect_right(view["indexes"], result.lastindex) - 1]
+                    return word, result
+        except TimeoutError:
+            # Find out the slow rules one by one
+            words = view["words"] + view["separate"]
+
+        for word in words:
+            result = get_search(compiled["patterns"][word], text, timeout, word, timeouts)
+
+            if result:
+                return word, result
+    except Exception as e:
+        logger.warning(f"Get matched error: {e}", exc_info=True)
+
+    return "", None
+
+
+def get_matched_forms(compiled: Dict[str, Any], forms: Tuple[str, str], ocr: bool = False, timeout: float = None,
+                      timeouts: List[str] = None, profile: Dict[str, List] = None) -> Tuple[str, Optional[Match]]:
+    # Check the collapsed form, then the stripped form with the rules that apply to it
+    for stripped, form in zip((False, True), forms):
+        if not form:
+            continue
+
+        word, result = get_matched(compiled, form, ocr, stripped, timeout, timeouts, profile)
+
+        if result:
+            return word, result
+
+    return "", None
+
+
+def get_ordered(words: Iterable[str], rates: Dict[str, float], excluded: Iterable[str] = ()) -> List[str]:
+    # Get the rules sorted by the decayed hit count, the stable sort keeps the original order of the others
+    excluded = set(excluded)
+    result = [word for word in words if word not in excluded]
+
+    try:
+        result.sort(key=lambda word: -rates.get(word, 0.0))
+    except Exception as e:
+        logger.warning(f"Get ordered error: {e}", exc_info=True)
+
+    return result
+
+
+def get_pattern(word: str) -> Optional[Pattern]:
+    # Get a compiled pattern of the rule
+    result = None
+
+    try:
+        result = regex.compile(get_folded(word), regex.I | regex.M | regex.S)
+    except Exception as e:
+        logger.warning(f"Compile rule {word} error: {e}")
+
+    return result
+
+
+def get_pool_hits(forms: Tuple[str, str], ocr: bool, timeout: float,
+                  word_types: Iterable[str]) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    # Get the first hit rule of every word type in a process pool worker, and the timed out rules
+    hits = {}
+    timeouts = []
+
+    try:
+        for word_type in word_types:
+            type_timeouts = []
+            word, _ = get_matched_forms(pool_compiled.get(word_type, {}), forms, ocr, timeout, type_timeouts)
+
+            if word:
+                hits[word_type] = word
+
+            timeouts += [(word_type, timeout_word) for timeout_word in type_timeouts]
+    except Exception as e:
+        logger.warning(f"Get pool hits error: {e}", exc_info=True)
+
+    return hits, timeouts
+
+
+def get_rules(words: Iterable[str], compiled: Dict[str, Any] = None) -> Dict[str, Any]:
+    # Get the compiled rules of a word type
+    result = {
+        "literals": {},
+        "order": {},
+        "patterns": {},
+        "views": {}
+    }
+
+    try:
+        old_literals = (compiled or {}).get("literals", {})
+        old_patterns = (compiled or {}).get("patterns", {})
+
+        for word in words:
+            pattern = old_patterns.get(word) or get_pattern(word)
+
+            if pattern is None:
+                continue
+
+            result["order"][word] = len(result["order"])
+            result["patterns"][word] = pattern
+            result["literals"][word] = old_literals[word] if word in old_literals else get_literal(word)
+
+        # Partition the rules by the forms of the text they apply to, the forms that skip no rule share the same view
+        views = {}
+
+        for ocr, stripped in [(False, False), (True, False), (False, True), (True, True)]:
+            rules = tuple(w for w in result["patterns"] if not get_marked(w, ocr, stripped))
+
+            if rules not in views:
+                views[rules] = get_view(rules, result["patterns"], result["literals"])
+
+            result["views"][(ocr, stripped)] = views[rules]
+    except Exception as e:
+        logger.warning(f"Get rules error: {e}", exc_info=True)
+
+    return result
+
+
+def get_search(pattern: Pattern, text: str, timeout: Optional[float], word: str,
+               timeouts: Optional[List[str]]) -> Optional[Match]:
+    # Search the text with a time limit, record the rule if it is timed out
+    result = None
+
+    try:
+        result = pattern.search(text, timeout=timeout)
+    except TimeoutError:
+        timeouts is not None and timeouts.append(word)
+
+    return result
+
+
+def get_special(words: Iterable[str]) -> Dict[str, str]:
+    # Get the special characters dictionary from the rules
+    result = {}
+
+    try:
+        for rule in words:
+            # Check keys
+            if "[" not in rule:
+                continue
+
+            # Check value
+            if "?#" not in rule:
+                continue
+
+            keys = rule.split("]")[0][1:]
+            value = rule.split("?#")[1][1]
+            for k in keys:
+                result[k] = value
+    except Exception as e:
+        logger.warning(f"Get special error: {e}", exc_info=True)
+
+    return result
+
+
+def get_view(words: Iterable[str], patterns: Dict[str, Pattern], literals: Dict[str, str]) -> Dict[str, Any]:
+    # Get the precompiled partition of the rules
+    result = {
+        "automaton": None,
+        "combined": None,
+        "indexed": [],
+        "indexes": [],
+        "separate": [],
+        "words": []
+    }
+
+    try:
+        # Index the required literals, only the rules whose literal is found need to be checked
+        result["automaton"] = get_automaton({word: literals[word] for word in words})
+
+        for word in words:
+            if result["automaton"] and literals[word]:
+                result["indexed"].append(word)
+            elif separate_pattern.search(word):
+                result["separate"].append(word)
+            else:
+                result["words"].append(word)
+
+        if not result["words"]:
+            return result
+
+        # Join the other rules into one alternation, remember the group index of each rule
+        index = 1
+
+        for word in result["words"]:
+            result["indexes"].append(index)
+            index += patterns[word].groups + 1
+
+        combined = get_pattern("|".join(f"({word})" for word in result["words"]))
+
+        if combined is None or combined.groups != index - 1:
+            result["separate"] += result["words"]
+            result["indexes"] = []
+            result["words"] = []
+        else:
+            result["combined"] = combined
+    except Exception as e:
+        logger.warning(f"Get view error: {e}", exc_info=True)
+
+    return result
+
+
+def init_pool(rules: Dict[str, List[str]]) -> bool:
+    # Compile the rules in a new process pool worker
+    try:
+        for word_type, words in rules.items():
+            pool_compiled[word_type] = get_compiled(words)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Init pool error: {e}", exc_info=True)
+
+    return False
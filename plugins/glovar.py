@@ -19,16 +19,21 @@
 import logging
 import pickle
 from codecs import getdecoder
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import RawConfigParser
+from multiprocessing.pool import Pool
 from os import mkdir
 from os.path import exists
 from shutil import rmtree
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Union
+from threading import Condition, Lock, local
+from typing import Any, Deque, Dict, List, Set, Tuple, Union
 
 from emoji import UNICODE_EMOJI
-from pyrogram.types import Chat, ChatMember
+from pyrogram.types import Chat, ChatMember, Message
+
+from .functions.words import get_compiled, get_ordered, get_special
 
 # TEMP
 normalize = True
@@ -76,12 +81,32 @@ lang_sticker: Union[str, Set[str]] = ""
 lang_text: Union[str, Set[str]] = ""
 limit_ban: int = 0
 limit_delete: int = 0
+limit_load: int = 0
+limit_shadow: int = 0
+limit_timeout: int = 0
+limit_verdict: int = 0
+pool: Union[bool, str] = ""
+pool_size: int = 0
+pool_workers: int = 0
 project_link: str = ""
 project_name: str = ""
+profile: Union[bool, str] = ""
+rate_decay: float = 0.0
+schedule_slots: int = 0
+shards: int = 0
+thread_workers: int = 0
+time_album: int = 0
 time_ban: int = 0
+time_count: int = 0
 time_delete: int = 0
 time_forgive: int = 0
+time_load: int = 0
 time_new: int = 0
+time_pool: int = 0
+time_quarantine: int = 0
+time_regex: float = 0.0
+time_shadow: int = 0
+time_starve: int = 0
 zh_cn: Union[bool, str] = ""
 
 # [emoji]
@@ -141,12 +166,34 @@ try:
     lang_text = set(lang_text.split())
     limit_ban = int(config["custom"].get("limit_ban", str(limit_ban)))
     limit_delete = int(config["custom"].get("limit_delete", str(limit_delete)))
+    limit_load = int(config["custom"].get("limit_load", str(limit_load)))
+    limit_shadow = int(config["custom"].get("limit_shadow", str(limit_shadow)))
+    limit_timeout = int(config["custom"].get("limit_timeout", str(limit_timeout)))
+    limit_verdict = int(config["custom"].get("limit_verdict", str(limit_verdict)))
+    pool = config["custom"].get("pool", pool)
+    pool = eval(pool)
+    pool_size = int(config["custom"].get("pool_size", str(pool_size)))
+    pool_workers = int(config["custom"].get("pool_workers", str(pool_workers)))
     project_link = config["custom"].get("project_link", project_link)
     project_name = config["custom"].get("project_name", project_name)
+    profile = config["custom"].get("profile", profile)
+    profile = eval(profile)
+    rate_decay = float(config["custom"].get("rate_decay", str(rate_decay)))
+    schedule_slots = int(config["custom"].get("schedule_slots", str(schedule_slots)))
+    shards = int(config["custom"].get("shards", str(shards)))
+    thread_workers = int(config["custom"].get("thread_workers", str(thread_workers)))
+    time_album = int(config["custom"].get("time_album", str(time_album)))
     time_ban = int(config["custom"].get("time_ban", str(time_ban)))
+    time_count = int(config["custom"].get("time_count", str(time_count)))
     time_delete = int(config["custom"].get("time_delete", str(time_delete)))
     time_forgive = int(config["custom"].get("time_forgive", str(time_forgive)))
+    time_load = int(config["custom"].get("time_load", str(time_load)))
     time_new = int(config["custom"].get("time_new", str(time_new)))
+    time_pool = int(config["custom"].get("time_pool", str(time_pool)))
+    time_quarantine = int(config["custom"].get("time_quarantine", str(time_quarantine)))
+    time_regex = float(config["custom"].get("time_regex", str(time_regex)))
+    time_shadow = int(config["custom"].get("time_shadow", str(time_shadow)))
+    time_starve = int(config["custom"].get("time_starve", str(time_starve)))
     zh_cn = config["custom"].get("zh_cn", zh_cn)
     zh_cn = eval(zh_cn)
 
@@ -194,12 +241,32 @@ if (avatar_id == 0
         or lang_text in {"", "[DATA EXPUNGED]"} or lang_text == set()
         or limit_ban == 0
         or limit_delete == 0
+        or limit_load == 0
+        or limit_shadow == 0
+        or limit_timeout == 0
+        or limit_verdict == 0
+        or pool not in {False, True}
+        or pool_size == 0
+        or pool_workers == 0
         or project_link in {"", "[DATA EXPUNGED]"}
         or project_name in {"", "[DATA EXPUNGED]"}
+        or profile not in {False, True}
+        or not 0 < rate_decay < 1
+        or schedule_slots == 0
+        or shards == 0
+        or thread_workers == 0
+        or time_album == 0
         or time_ban == 0
+        or time_count == 0
         or time_delete == 0
         or time_forgive == 0
+        or time_load == 0
         or time_new == 0
+        or time_pool == 0
+        or time_quarantine == 0
+        or time_regex == 0.0
+        or time_shadow == 0
+        or time_starve == 0
         or zh_cn not in {False, True}
         or emoji_ad_single == 0
         or emoji_ad_total == 0
@@ -229,7 +296,9 @@ lang: Dict[str, str] = {
     "name": (zh_cn and "名称") or "Name",
     "reason": (zh_cn and "原因") or "Reason",
     "reset": (zh_cn and "重置数据") or "Reset Data",
+    "quarantine": (zh_cn and "隔离规则") or "Quarantine Rule",
     "rollback": (zh_cn and "数据回滚") or "Rollback",
+    "rule_update": (zh_cn and "更新规则") or "Update Rules",
     "score": (zh_cn and "评分") or "Score",
     "status_failed": (zh_cn and "未执行") or "Failed",
     "version": (zh_cn and "版本") or "Version",
@@ -251,6 +320,13 @@ lang: Dict[str, str] = {
     "message_lang": (zh_cn and "消息语言") or "Message Language",
     "message_len": (zh_cn and "消息长度") or "Message Length",
     "message_freq": (zh_cn and "消息频率") or "Message Frequency",
+    "memo_rate": (zh_cn and "检测缓存命中率") or "Detection Memo Hit Rate",
+    "queue_depth": (zh_cn and "任务队列深度") or "Queue Depth",
+    "schedule_latency": (zh_cn and "调度等待时间") or "Schedule Latency",
+    "regex_timeout": (zh_cn and "规则匹配超时") or "Regex Timeout",
+    "shadow_diffs": (zh_cn and "结果差异") or "Verdict Diffs",
+    "shadow_samples": (zh_cn and "影子测试样本") or "Shadow Samples",
+    "shadow_time": (zh_cn and "平均耗时") or "Average Time",
     "user_score": (zh_cn and "用户得分") or "User Score",
     "user_bio": (zh_cn and "用户简介") or "User Bio",
     "user_name": (zh_cn and "用户昵称") or "User Name",
@@ -287,6 +363,14 @@ lang: Dict[str, str] = {
 
 # Init
 
+albums: Dict[str, Dict[str, Union[int, List[Message]]]] = {}
+# albums = {
+#     "12345678901234567": {
+#         "messages": [Message],
+#         "time": 1512345678
+#     }
+# }
+
 bot_ids: Set[int] = {avatar_id, captcha_id, clean_id, lang_id, long_id, noflood_id,
                      noporn_id, nospam_id, recheck_id, tip_id, user_id, warn_id}
 
@@ -295,11 +379,42 @@ chats: Dict[int, Chat] = {}
 #     -10012345678: Chat
 # }
 
+compiled: Dict[str, Dict[str, Any]] = {}
+# compiled = {
+#     "wb": {
+#         "literals": {
+#             "literal": "literal",
+#             "regex": ""
+#         },
+#         "order": {
+#             "literal": 0,
+#             "regex": 1
+#         },
+#         "patterns": {
+#             "literal": Pattern,
+#             "regex": Pattern
+#         },
+#         "views": {
+#             (False, False): {
+#                 "automaton": Automaton,
+#                 "combined": Pattern,
+#                 "indexed": ("literal",),
+#                 "indexes": (1,),
+#                 "separate": (),
+#                 "words": ("regex",)
+#             }
+#         }
+#     }
+# }
+
 contents: Dict[str, str] = {}
 # contents = {
 #     "content": "wb"
 # }
 
+counts: Deque[Tuple[str, str]] = deque()
+# counts = deque([("wb", "regex")])
+
 declared_message_ids: Dict[int, Set[int]] = {}
 # declared_message_ids = {
 #     -10012345678: {123}
@@ -326,11 +441,53 @@ default_user_status: Dict[str, Union[int, str, Dict[Union[int, str], Union[float
 
 emoji_set: Set[str] = set(UNICODE_EMOJI)
 
-locks: Dict[str, Lock] = {
-    "message": Lock(),
+executors: Dict[str, ThreadPoolExecutor] = {
+    "album": ThreadPoolExecutor(thread_workers, "album"),
+    "detect": ThreadPoolExecutor(thread_workers, "detect"),
+    "regex": ThreadPoolExecutor(thread_workers, "regex"),
+    "io": ThreadPoolExecutor(thread_workers, "io"),
+    "crypto": ThreadPoolExecutor(thread_workers, "crypto"),
+    "persistence": ThreadPoolExecutor(1, "persistence")
+}
+# The tasks run in the queues by their kind, the saves are written one by one.
+# The albums wait for the checks of their messages in detect, so the checks never wait behind the network calls.
+# A task may submit new tasks to any queue, so the executors are shut down after all the queues are empty
+
+latencies: Dict[str, Dict[str, Union[float, int]]] = {}
+# latencies = {
+#     "detect": {
+#         "count": 1,
+#         "max": 0.1,
+#         "run": 0.5,
+#         "wait": 0.1
+#     }
+# }
+
+load: Dict[str, bool] = {
+    "degraded": False
+}
+# Under high load, the detection skips OCR and the preview images
+
+locks: Dict[str, Union[Condition, Lock]] = {
+    "album": Lock(),
+    "pool": Lock(),
+    "queue": Lock(),
     "receive": Lock(),
     "regex": Lock(),
-    "text": Lock()
+    "save": Lock(),
+    "schedule": Condition(),
+    "shadow": Lock(),
+    "verdict": Lock()
+}
+
+memo: local = local()
+# memo.results = {
+#     ("is_wb_text", "text", False): True
+# }
+
+memo_counts: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0
 }
 
 members: Dict[int, Dict[int, ChatMember]] = {}
@@ -340,6 +497,45 @@ members: Dict[int, Dict[int, ChatMember]] = {}
 #     }
 # }
 
+pools: Dict[str, Union[bool, int, Pool]] = {}
+# pools = {
+#     "building": False,
+#     "pool": Pool,
+#     "version": 0
+# }
+
+priorities: Dict[str, int] = {
+    "detect": 0,
+    "join": 1,
+    "exchange": 2
+}
+# The handlers wait for a schedule slot by these classes, the smaller one goes first.
+# Pyrogram takes the updates from its queue in arrival order, so only the handlers that are already taken,
+# at most Client.workers of them, are reordered, and a waiting handler holds a Pyrogram worker
+
+profile_records: Deque[Tuple[str, Dict[str, List[Union[float, int]]]]] = deque()
+# profile_records = deque([("wb", {"regex": [0.001, 1, 1]})])
+
+profiles: Dict[str, Dict[str, List[Union[float, int]]]] = {}
+# profiles = {
+#     "wb": {
+#         "regex": [0.001, 1, 1]
+#     }
+# }
+
+quarantine: Dict[str, Set[str]] = {}
+# quarantine = {
+#     "wb": {"regex"}
+# }
+
+queues: Dict[str, Dict[str, int]] = {queue: {"pending": 0, "peak": 0} for queue in executors}
+# queues = {
+#     "io": {
+#         "pending": 0,
+#         "peak": 3
+#     }
+# }
+
 receivers: Dict[str, List[str]] = {
     "watch": ["ANALYZE", "CAPTCHA", "CLEAN", "LANG", "LONG", "MANAGE",
               "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TIP", "USER", "WARN", "WATCH"]
@@ -365,16 +561,64 @@ regex: Dict[str, bool] = {
     "wd": True
 }
 
+# Word types that the text filters use
+regex_text: Set[str] = {"ad", "ban", "bio", "con", "iml", "nm", "pho", "sho", "spc", "spe", "tgp", "wb", "wd"}
+
 for c in ascii_lowercase:
     regex[f"ad{c}"] = True
+    regex_text.add(f"ad{c}")
+
+saving: Set[str] = set()
+# saving = {"user_ids"}
+
+schedule: Dict[str, Union[int, List[Tuple[int, int, float]]]] = {
+    "count": 0,
+    "running": 0,
+    "waiting": []
+}
+# schedule = {
+#     "count": 3,
+#     "running": 1,
+#     "waiting": [(2, 3, 1573000000.0)]
+# }
 
 sender: str = "WATCH"
 
+shadows: Dict[str, Dict[str, Any]] = {}
+# shadows = {
+#     "wb": {
+#         "compiled": MappingProxyType,
+#         "count": 1,
+#         "data": {"regex": 0},
+#         "diffs": 0,
+#         "samples": deque([("text", False)]),
+#         "start": 1512345678,
+#         "time_new": 0.001,
+#         "time_old": 0.001,
+#         "timeouts": ["regex"]
+#     }
+# }
+
 sticker_titles: Dict[str, str] = {}
 # sticker_titles = {
 #     "short_name": "sticker_title"
 # }
 
+stopping: bool = False
+
+timeout_counts: Dict[str, Dict[str, int]] = {}
+# timeout_counts = {
+#     "wb": {
+#         "regex": 1
+#     }
+# }
+
+timeouts: Deque[Tuple[str, str]] = deque()
+# timeouts = deque([("wb", "regex")])
+
+user_locks: List[Lock] = [Lock() for _ in range(shards)]
+# The messages of the same user are checked one by one, the users in different shards are checked in parallel
+
 usernames: Dict[str, Dict[str, Union[int, str]]] = {}
 # usernames = {
 #     "SCP_079": {
@@ -383,8 +627,15 @@ usernames: Dict[str, Dict[str, Union[int, str]]] = {}
 #     }
 # }
 
+verdicts: Dict[tuple, Any] = OrderedDict()
+# verdicts = OrderedDict([
+#     ((0, "get_regex_results", b"md5", False), {"wb": "regex"})
+# ])
+
 version: str = "0.1.3"
 
+version_rules: int = 0
+
 # Load data from pickle
 
 # Init dir
@@ -450,49 +701,68 @@ user_ids: Dict[int, Dict[str, Union[int, str, Dict[Union[int, str], Union[float,
 
 # Init word variables
 
-for word_type in regex:
-    locals()[f"{word_type}_words"]: Dict[str, Dict[str, Union[float, int]]] = {}
+words: Dict[str, Dict[str, int]] = {word_type: {} for word_type in regex}
+# words = {
+#     "wb": {
+#         "regex": 0
+#     }
+# }
 
-# type_words = {
-#     "regex": 0
+# Init rate variables
+
+rates: Dict[str, Dict[str, float]] = {word_type: {} for word_type in regex}
+# rates = {
+#     "wb": {
+#         "regex": 1.5
+#     }
 # }
 
 # Load data
-file_list: List[str] = ["bad_ids", "except_ids", "user_ids"]
+file_list: List[str] = ["bad_ids", "except_ids", "rates", "user_ids"]
 file_list += [f"{f}_words" for f in regex]
 for file in file_list:
+    # The words files are kept in the words registry, the file names are not changed
+    if file.endswith("_words"):
+        data_dict, data_key = words, file.split("_")[0]
+    else:
+        data_dict, data_key = locals(), file
+
     try:
         try:
             if exists(f"data/{file}") or exists(f"data/.{file}"):
                 with open(f"data/{file}", "rb") as f:
-                    locals()[f"{file}"] = pickle.load(f)
+                    data_dict[data_key] = pickle.load(f)
             else:
                 with open(f"data/{file}", "wb") as f:
-                    pickle.dump(eval(f"{file}"), f)
+                    pickle.dump(data_dict[data_key], f)
         except Exception as e:
             logger.error(f"Load data {file} error: {e}", exc_info=True)
             with open(f"data/.{file}", "rb") as f:
-                locals()[f"{file}"] = pickle.load(f)
+                data_dict[data_key] = pickle.load(f)
     except Exception as e:
         logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
         raise SystemExit("[DATA CORRUPTION]")
 
+# Migrate the words data of the old format, only the counts are reset
+for word_type in words:
+    if not isinstance(words[word_type], dict):
+        words[word_type] = {word: 0 for word in words[word_type]}
+
+    for word in list(words[word_type]):
+        if not isinstance(words[word_type][word], int):
+            words[word_type][word] = 0
+
+# Compile the regex rules, the rules that hit more often are checked first
+for word_type in regex:
+    compiled[word_type] = get_compiled(get_ordered(words[word_type], rates.get(word_type, {})))
+
 # Generate special characters dictionary
-for special in ["spc", "spe"]:
-    locals()[f"{special}_dict"]: Dict[str, str] = {}
-    for rule in locals()[f"{special}_words"]:
-        # Check keys
-        if "[" not in rule:
-            continue
-
-        # Check value
-        if "?#" not in rule:
-            continue
-
-        keys = rule.split("]")[0][1:]
-        value = rule.split("?#")[1][1]
-        for k in keys:
-            locals()[f"{special}_dict"][k] = value
+special_dicts: Dict[str, Dict[str, str]] = {special: get_special(words[special]) for special in ["spc", "spe"]}
+# special_dicts = {
+#     "spc": {
+#         "a": "b"
+#     }
+# }
 
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019 SCP-079 <https://scp-079.org>\n"
@@ -22,19 +22,20 @@ from pyrogram import Client, filters
 from pyrogram.types import Message
 
 from .. import glovar
-from ..functions.channel import get_content
-from ..functions.etc import get_full_name, get_now, t2t, thread
+from ..functions.context import get_context
+from ..functions.decorators import scheduled
+from ..functions.etc import get_full_name, get_now, get_user_lock, t2t, thread
 from ..functions.file import save
 from ..functions.filters import class_c, class_d, class_e, declared_message, from_user, hide_channel, is_bio_text
 from ..functions.filters import is_nm_text, is_declared_message, is_high_score_user, is_lang, is_watch_message
 from ..functions.filters import is_watch_user, new_user, watch_ban
-from ..functions.ids import init_user_id
+from ..functions.ids import add_except_content, init_user_id
 from ..functions.receive import receive_add_bad, receive_add_except, receive_clear_data, receive_declared_message
-from ..functions.receive import receive_regex, receive_remove_bad, receive_remove_except, receive_remove_score
-from ..functions.receive import receive_remove_watch, receive_rollback, receive_status_ask, receive_text_data
-from ..functions.receive import receive_user_score, receive_version_ask, receive_watch_user
+from ..functions.receive import receive_profile_ask, receive_regex, receive_remove_bad, receive_remove_except
+from ..functions.receive import receive_remove_score, receive_remove_watch, receive_rollback, receive_status_ask
+from ..functions.receive import receive_text_data, receive_user_score, receive_version_ask, receive_watch_user
 from ..functions.timers import backup_files, send_count
-from ..functions.user import terminate_user
+from ..functions.user import add_album, terminate_user
 from ..functions.telegram import get_user_full
 
 # Enable logging
@@ -44,15 +45,13 @@ logger = logging.getLogger(__name__)
 @Client.on_message(filters.incoming & filters.group & ~filters.service
                    & from_user & ~class_c & ~class_d & ~class_e & new_user & ~watch_ban
                    & ~declared_message)
+@scheduled("detect")
 def check(client: Client, message: Message) -> bool:
     # Check the messages sent from groups
 
-    has_text = bool(message and (message.text or message.caption))
-
-    if has_text:
-        glovar.locks["text"].acquire()
-    else:
-        glovar.locks["message"].acquire()
+    # The messages of the same user are checked in order, other users are not blocked
+    lock = get_user_lock(message.from_user.id)
+    lock.acquire()
 
     try:
         # Check declare status
@@ -67,35 +66,36 @@ def check(client: Client, message: Message) -> bool:
         if is_high_score_user(message.from_user):
             return True
 
+        # Check the album as one unit after its messages are collected
+        if message.media_group_id:
+            return add_album(client, message)
+
         # Watch message
-        content = get_content(message)
-        detection = is_watch_message(client, message)
+        context = get_context(message)
+        content = context.content
+        detection = is_watch_message(client, message, context)
         if detection:
-            result = terminate_user(client, message, detection)
+            result = terminate_user(client, message, detection, context)
             if result:
                 glovar.contents[content] = detection
         elif message.sticker:
-            if content:
-                glovar.except_ids["temp"].add(content)
-                save("except_ids")
+            # The user lock is held here, so the receive lock is taken in another thread
+            content and thread(add_except_content, ("temp", content))
 
         return True
     except Exception as e:
         logger.warning(f"Check error: {e}", exc_info=True)
     finally:
-        if has_text:
-            glovar.locks["text"].release()
-        else:
-            glovar.locks["message"].release()
+        lock.release()
 
     return False
 
 
 @Client.on_message(filters.incoming & filters.group & filters.new_chat_members
                    & from_user & ~class_c)
+@scheduled("join")
 def check_join(client: Client, message: Message) -> bool:
     # Check new joined user
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         now = message.date or get_now()
@@ -127,25 +127,24 @@ def check_join(client: Client, message: Message) -> bool:
             if bio and (is_bio_text(bio) or is_lang("bio", bio)):
                 continue
 
-            # Init the user's status
-            if not init_user_id(uid):
-                continue
+            # Update the user's join status in the user's shard
+            with get_user_lock(uid):
+                if not init_user_id(uid):
+                    continue
 
-            # Update the user's join status
-            glovar.user_ids[uid]["join"] = now
-            save("user_ids")
+                glovar.user_ids[uid]["join"] = now
+                save("user_ids")
 
         return True
     except Exception as e:
         logger.warning(f"Check join error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
 
 @Client.on_message((filters.incoming or glovar.aio) & filters.channel
                    & hide_channel)
+@scheduled("exchange")
 def process_data(client: Client, message: Message) -> bool:
     # Process the data in exchange channel
     glovar.locks["receive"].acquire()
@@ -240,6 +239,10 @@ def process_data(client: Client, message: Message) -> bool:
                 elif action == "clear":
                     receive_clear_data(client, action_type, data)
 
+                elif action == "profile":
+                    if action_type == "ask":
+                        receive_profile_ask(client, sender, data)
+
                 elif action == "remove":
                     if action_type == "bad":
                         receive_remove_bad(data)
@@ -318,6 +321,9 @@ def process_data(client: Client, message: Message) -> bool:
                     elif action_type == "count":
                         if data == "ask":
                             send_count(client)
+                    elif action_type == "profile":
+                        if data == "ask":
+                            receive_profile_ask(client, sender, data)
 
         return True
     except Exception as e:
@@ -0,0 +1,72 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+from os.path import abspath, dirname, join
+from types import ModuleType
+
+import pytest
+
+root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, root)
+
+# The example config with the values that pass the settings check
+with open(join(root, "config.ini.example"), encoding="utf-8") as f:
+    config = f.read()
+
+config = config.replace("key = [DATA EXPUNGED]", f"key = {'A' * 43}=")
+config = config.replace("[DATA EXPUNGED]", "1")
+
+
+@pytest.fixture(autouse=True)
+def workdir(monkeypatch, tmp_path):
+    # The plugins read config.ini and use the data directories in the working directory,
+    # so every test runs in a temporary directory with the example config
+    (tmp_path / "config.ini").write_text(config, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
+
+
+@pytest.fixture
+def glovar(workdir) -> ModuleType:
+    # The global variables are loaded when they are first imported
+    from plugins import glovar
+
+    return glovar
+
+
+@pytest.fixture
+def etc(glovar) -> ModuleType:
+    from plugins.functions import etc
+
+    return etc
+
+
+@pytest.fixture
+def filters(glovar) -> ModuleType:
+    from plugins.functions import filters
+
+    return filters
+
+
+@pytest.fixture
+def receive(glovar) -> ModuleType:
+    from plugins.functions import receive
+
+    return receive
@@ -0,0 +1,56 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+from os.path import abspath, dirname, join
+from types import ModuleType
+
+from plugins.functions.words import get_compiled, get_pool_hits
+
+root = dirname(dirname(abspath(__file__)))
+
+
+def test_pool_keeps_tmp(monkeypatch, workdir, glovar, etc):
+    # The workers of the process pool never clean the tmp directory of the bot
+    live = workdir / "tmp" / "live.jpg"
+    live.parent.mkdir(exist_ok=True)
+    live.write_bytes(b"live")
+
+    # The workers import the main module as they do in the bot
+    main = ModuleType("__main__")
+    main.__file__ = join(root, "main.py")
+    monkeypatch.setitem(sys.modules, "__main__", main)
+
+    monkeypatch.setattr(glovar, "compiled", {"wb": get_compiled(["spam+"])})
+    monkeypatch.setattr(glovar, "pools", {"building": True})
+    monkeypatch.setattr(glovar, "regex_text", {"wb"})
+    monkeypatch.setattr(glovar, "time_pool", 0)
+
+    assert etc.build_pool()
+
+    pool = glovar.pools["pool"]
+
+    try:
+        hits, timeouts = pool.apply(get_pool_hits, (("a spammm b", ""), False, 1.0, ["wb"]))
+    finally:
+        pool.terminate()
+
+    assert hits == {"wb": "spam+"}
+    assert not timeouts
+    assert not glovar.pools["building"]
+    assert live.exists()
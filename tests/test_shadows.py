@@ -0,0 +1,109 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+from time import time
+
+import pytest
+
+from plugins.functions.words import get_compiled
+
+
+def get_shadow(words_data: dict) -> dict:
+    # Get a rule update in shadow mode
+    return {
+        "compiled": None,
+        "count": 0,
+        "data": words_data,
+        "diffs": 0,
+        "samples": deque(),
+        "start": int(time()),
+        "time_new": 0.0,
+        "time_old": 0.0,
+        "timeouts": []
+    }
+
+
+@pytest.fixture(autouse=True)
+def stubs(monkeypatch, glovar, receive):
+    # Keep the rules and the messages of the tests local
+    sent = []
+    monkeypatch.setattr(receive, "thread", lambda *args, **kwargs: True)
+    monkeypatch.setattr(receive, "save", lambda file: True)
+    monkeypatch.setattr(receive, "send_quarantine", lambda client, word_type, word: sent.append(word))
+    monkeypatch.setattr(glovar, "compiled", {"wb": get_compiled(["old"])})
+    monkeypatch.setattr(glovar, "words", {"wb": {"old": 0}})
+    monkeypatch.setattr(glovar, "shadows", {})
+    monkeypatch.setattr(glovar, "quarantine", {})
+    monkeypatch.setattr(glovar, "timeout_counts", {})
+    monkeypatch.setattr(glovar, "stopping", False)
+    monkeypatch.setattr(glovar, "limit_shadow", 2)
+
+    return sent
+
+
+def test_shadow_evaluated_by_timer(stubs, glovar, receive):
+    # The samples are evaluated by check_shadows, the update is applied after enough samples
+    shadow = get_shadow({"new": 0, "slow": 0})
+    glovar.shadows["wb"] = shadow
+    receive.compile_shadow(None, "wb", shadow)
+
+    shadow["samples"].append(("old text", False))
+    receive.check_shadows(None)
+
+    assert glovar.shadows["wb"] is shadow
+    assert shadow["count"] == 1
+    assert shadow["diffs"] == 1
+
+    shadow["samples"].append(("new text", False))
+    shadow["timeouts"] += ["slow"] * glovar.limit_timeout
+    receive.check_shadows(None)
+
+    assert "wb" not in glovar.shadows
+    assert set(glovar.words["wb"]) == {"new", "slow"}
+    assert glovar.quarantine["wb"] == {"slow"}
+    assert list(glovar.compiled["wb"]["order"]) == ["new"]
+    assert stubs == ["slow"]
+
+
+def test_shadow_applied_when_stopping(glovar, receive):
+    # The pending update is applied at once when the program is stopping
+    shadow = get_shadow({"new": 0})
+    glovar.shadows["wb"] = shadow
+    receive.compile_shadow(None, "wb", shadow)
+
+    shadow["samples"].append(("new text", False))
+    receive.check_shadows(None, True)
+
+    assert "wb" not in glovar.shadows
+    assert shadow["count"] == 0
+    assert list(glovar.compiled["wb"]["order"]) == ["new"]
+
+
+def test_shadow_compiled_after_stopping(glovar, receive):
+    # The update that is compiled after the last check is applied by the compilation
+    shadow = get_shadow({"new": 0})
+    glovar.shadows["wb"] = shadow
+    receive.check_shadows(None, True)
+
+    assert glovar.shadows["wb"] is shadow
+
+    receive.compile_shadow(None, "wb", shadow)
+
+    assert "wb" not in glovar.shadows
+    assert list(glovar.compiled["wb"]["order"]) == ["new"]
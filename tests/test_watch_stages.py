@@ -0,0 +1,539 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+from typing import Any, Dict
+
+import pytest
+
+# The is_watch_message of version 0.1.3 (commit 5b4c947) before it was split into stages, copied verbatim.
+# The stage table must give the same verdicts
+BASELINE = r'''
+def is_watch_message(client: Client, message: Message) -> str:
+    # Check if the message should be watched
+    result = ""
+    need_delete = []
+    try:
+        if not message.chat:
+            return ""
+
+        # Basic data
+        gid = message.chat.id
+        uid = message.from_user.id
+
+        if not init_user_id(uid):
+            return ""
+
+        # Start detect watch ban
+
+        # Check detected records
+        message_content = get_content(message)
+        if message_content:
+            detection = glovar.contents.get(message_content, "")
+            if detection:
+                return detection
+
+        # Work with NOSPAM, check the message's text
+        message_text = get_text(message, True, True)
+        if message_text:
+            if is_ban_text(message_text, False):
+                return ""
+
+        # Bypass
+        message_text = get_text(message)
+        description = get_description(client, gid)
+        if (description and message_text) and message_text in description:
+            return ""
+
+        pinned_message = get_pinned(client, gid)
+        pinned_content = get_content(pinned_message)
+        if (pinned_content and message_content) and message_content in pinned_content:
+            return ""
+
+        pinned_text = get_text(pinned_message)
+        if (pinned_text and message_text) and message_text in pinned_text:
+            return ""
+
+        # Work with NOSPAM and default LANG, check the forward from name:
+        forward_name = get_forward_name(message)
+        if forward_name:
+            if is_nm_text(forward_name) or is_lang("name", forward_name):
+                return ""
+
+        # Check the message's text
+        message_text = get_text(message)
+        if message_text:
+            if is_wb_text(message_text, False) or is_lang("text", message_text):
+                return "ban"
+
+        # Check channel restriction
+        if is_restricted_channel(message):
+            return "ban"
+
+        # Check the forward from name
+        if forward_name and forward_name not in glovar.except_ids["long"]:
+            if is_wb_text(forward_name, False) or is_lang("name", forward_name):
+                return "ban"
+
+        # Check the filename
+        file_name = get_filename(message)
+        if file_name:
+            if is_regex_text("fil", file_name) or is_ban_text(file_name, False):
+                return ""
+
+            if is_wb_text(file_name, False) or is_lang("text", file_name):
+                return "ban"
+
+        # Check exe file
+        if is_exe(message):
+            return "ban"
+
+        # Check Telegram link
+        if is_tgl(client, message):
+            return "delete"
+
+        # Check image
+        ocr = ""
+        all_text = ""
+
+        # Get the image
+        file_id, file_ref, big = get_file_id(message)
+        image_path = big and get_downloaded_path(client, file_id, file_ref)
+        image_path and need_delete.append(image_path)
+
+        # Check declared status
+        if is_declared_message(None, None, message):
+            return ""
+
+        # Check hash
+        image_hash = image_path and get_md5sum("file", image_path)
+        if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
+            # Check declare status
+            if is_declared_message(None, None, message):
+                return ""
+
+            if big:
+                # Get QR code
+                qrcode = get_qrcode(image_path)
+                if qrcode:
+                    if is_ban_text(qrcode, False):
+                        return ""
+
+                    return "ban"
+
+                # Get OCR
+                ocr = get_ocr(image_path)
+                if ocr:
+                    if is_ban_text(ocr, True):
+                        return ""
+
+                    if is_wb_text(ocr, True):
+                        return "ban"
+
+                    if message_text:
+                        all_text = message_text + ocr
+                        if is_ban_text(all_text, False):
+                            return ""
+
+                        if is_wb_text(all_text, False):
+                            return "ban"
+
+        # Check sticker title
+        sticker_title = ""
+
+        if message.sticker:
+            sticker_name = message.sticker.set_name
+        else:
+            sticker_name = ""
+
+        if sticker_name:
+            if sticker_name not in glovar.except_ids["long"]:
+                if is_regex_text("wb", sticker_name):
+                    return "ban"
+
+            sticker_title = get_sticker_title(client, sticker_name)
+            if is_regex_text("wb", sticker_title) or is_lang("sticker", sticker_title):
+                return f"ban {sticker_title}"
+
+        # Check preview
+        preview_text = ""
+
+        web_page: WebPage = message.web_page
+
+        if web_page:
+            preview_text = web_page.display_url + "\n\n"
+
+            if web_page.site_name:
+                preview_text += web_page.site_name + "\n\n"
+
+            if web_page.title:
+                preview_text += web_page.title + "\n\n"
+
+            if web_page.description:
+                preview_text += web_page.description + "\n\n"
+
+            if is_ban_text(preview_text, False):
+                return ""
+
+            if is_wb_text(preview_text, False) or is_lang("text", preview_text):
+                return "ban"
+
+            if web_page.photo and web_page.photo.file_size <= glovar.image_size:
+                # Get the image
+                file_id = web_page.photo.file_id
+                file_ref = web_page.photo.file_ref
+                image_path = get_downloaded_path(client, file_id, file_ref)
+                image_path and need_delete.append(image_path)
+
+                # Check declared status
+                if is_declared_message(None, None, message):
+                    return ""
+
+                # Check hash
+                image_hash = image_path and get_md5sum("file", image_path)
+                if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
+                    # Check declare status
+                    if is_declared_message(None, None, message):
+                        return ""
+
+                    # Get QR code
+                    qrcode = get_qrcode(image_path)
+                    if qrcode:
+                        if is_ban_text(qrcode, False):
+                            return ""
+
+                        return "ban"
+
+                    # Get OCR
+                    ocr = get_ocr(image_path)
+                    if ocr:
+                        if is_ban_text(ocr, True):
+                            return ""
+
+                        if is_wb_text(ocr, True):
+                            return "ban"
+
+                        if message_text:
+                            all_text = message_text + ocr
+                            if is_ban_text(all_text, False):
+                                return ""
+
+                            if is_wb_text(all_text, False):
+                                return "ban"
+
+        # Start detect watch delete
+
+        # Check if the user is already in watch delete
+        if is_watch_delete(None, None, message):
+            return ""
+
+        # Check detected records
+        if message_content:
+            detection = glovar.contents.get(message_content, "")
+            if detection == "delete":
+                return detection
+
+        # Some media type
+        if (message.animation
+                or message.audio
+                or message.document
+                or message.game
+                or message.location
+                or message.venue
+                or message.via_bot
+                or message.video
+                or message.video_note):
+            return "delete"
+
+        # Forwarded message
+        if message.forward_from or message.forward_sender_name or message.forward_from_chat:
+            return "delete"
+
+        # Check the message's text
+        if message_text:
+            if is_wd_text(message_text, False):
+                return "delete"
+
+        # Check image
+        if ocr:
+            if is_wd_text(message_text, True):
+                return "delete"
+
+        if all_text:
+            if is_wd_text(all_text, False):
+                return "delete"
+
+        if image_path:
+            color = get_color(image_path)
+            if color:
+                return "delete"
+
+        # Check sticker
+        if sticker_title and sticker_title not in glovar.except_ids["long"]:
+            if is_regex_text("wd", sticker_title):
+                return f"delete {sticker_title}"
+
+        # Check preview
+        if preview_text:
+            if is_wd_text(preview_text, False):
+                return "delete"
+
+        if web_page:
+            if (web_page.audio
+                    or web_page.document
+                    or web_page.animation
+                    or web_page.video):
+                return "delete"
+    except Exception as e:
+        logger.warning(f"Is watch message error: {e}", exc_info=True)
+    finally:
+        for file in need_delete:
+            thread(delete_file, (file,))
+
+    return result
+'''
+
+# The images of the current case, keyed by the downloaded path
+images: Dict[str, Dict[str, str]] = {}
+
+
+class FakeContext:
+    # The context of a fake message, the fields are set by the case
+    def __init__(self, message: SimpleNamespace):
+        self.message = message
+        self.content = message.content
+        self.file_id = message.image
+        self.filename = message.filename
+        self.forward_name = message.forward_name
+
+    def text(self, normal: bool = False, printable: bool = True) -> str:
+        return self.message.text
+
+
+def get_message(**kwargs) -> SimpleNamespace:
+    # Get a fake message, the fields that are not given are empty
+    fields = {
+        "chat": SimpleNamespace(id=-1001),
+        "from_user": SimpleNamespace(id=1),
+        "content": "",
+        "declared": False,
+        "exe": False,
+        "filename": "",
+        "forward_name": "",
+        "image": ("", "", False),
+        "restricted": False,
+        "text": "",
+        "tgl": False,
+        "watch_delete": False,
+        "sticker": None,
+        "web_page": None,
+        "animation": None,
+        "audio": None,
+        "document": None,
+        "game": None,
+        "location": None,
+        "venue": None,
+        "via_bot": None,
+        "video": None,
+        "video_note": None,
+        "forward_from": None,
+        "forward_sender_name": None,
+        "forward_from_chat": None
+    }
+    fields.update(kwargs)
+
+    return SimpleNamespace(**fields)
+
+
+def get_web_page(**kwargs) -> SimpleNamespace:
+    # Get a fake web page
+    fields = {
+        "display_url": "example.com",
+        "site_name": "",
+        "title": "",
+        "description": "",
+        "photo": None,
+        "audio": None,
+        "document": None,
+        "animation": None,
+        "video": None
+    }
+    fields.update(kwargs)
+
+    return SimpleNamespace(**fields)
+
+
+def get_photo(file_id: str, file_size: int = 1) -> SimpleNamespace:
+    # Get a fake photo of the web page
+    return SimpleNamespace(file_id=file_id, file_ref="", file_size=file_size)
+
+
+@pytest.fixture
+def baseline(filters) -> Any:
+    # Compile the baseline with the globals of the filters module, so it calls the same stubs
+    namespace = {}
+    exec(compile(BASELINE, "baseline", "exec"), filters.__dict__, namespace)
+
+    return namespace["is_watch_message"]
+
+
+@pytest.fixture(autouse=True)
+def stubs(monkeypatch, filters, glovar):
+    # Replace the checks and the API calls with deterministic stubs driven by the markers in the texts
+    images.clear()
+
+    def get_image(path: str, key: str) -> str:
+        return images.get(path, {}).get(key, "")
+
+    replacements = {
+        "init_user_id": lambda uid: True,
+        "get_regex_hits": lambda text, ocr: {},
+        "is_ban_text": lambda text, ocr, message=None, hits=None: "nospam" in text,
+        "is_nm_text": lambda text, hits=None: "nm" in text,
+        "is_wb_text": lambda text, ocr, hits=None: "wb" in text,
+        "is_wd_text": lambda text, ocr, hits=None: "wd" in text,
+        "is_lang": lambda the_type, text: "lang" in text,
+        "is_regex_text": lambda word_type, text, ocr=False: bool(text) and word_type in text,
+        "is_declared_message": lambda _, __, message: message.declared,
+        "is_exe": lambda message, context=None: message.exe,
+        "is_restricted_channel": lambda message: message.restricted,
+        "is_tgl": lambda client, message, friend=False, context=None: message.tgl,
+        "is_watch_delete": lambda _, __, message: message.watch_delete,
+        "get_description": lambda client, gid: client.description,
+        "get_pinned": lambda client, gid: client.pinned,
+        "get_content": lambda message: (message and message.content) or "",
+        "get_text": lambda message, *args, **kwargs: (message and message.text) or "",
+        "get_file_id": lambda message: message.image,
+        "get_filename": lambda message: message.filename,
+        "get_forward_name": lambda message: message.forward_name,
+        "get_downloaded_path": lambda client, file_id, file_ref: file_id and f"tmp/{file_id}",
+        "get_md5sum": lambda the_type, path: path,
+        "get_qrcode": lambda path: get_image(path, "qrcode"),
+        "get_ocr": lambda path: get_image(path, "ocr"),
+        "get_color": lambda path: get_image(path, "color"),
+        "get_sticker_title": lambda client, name: f"title {name}",
+        "thread": lambda *args, **kwargs: True
+    }
+
+    for name, value in replacements.items():
+        # The baseline calls the helpers that the filters module no longer imports
+        monkeypatch.setattr(filters, name, value, raising=False)
+
+    monkeypatch.setattr(glovar, "contents", {"record ban": "ban", "record delete": "delete"})
+    monkeypatch.setattr(glovar, "except_ids", {"long": {"long wb"}, "temp": {"tmp/temp"}})
+    monkeypatch.setattr(glovar, "image_size", 10)
+    monkeypatch.setitem(glovar.load, "degraded", False)
+
+
+def get_client(description: str = "", pinned: SimpleNamespace = None) -> SimpleNamespace:
+    # Get a fake client with the group's description and pinned message
+    return SimpleNamespace(description=description, pinned=pinned)
+
+
+cases = {
+    "plain": (get_client(), get_message(text="hello"), {}, ""),
+    "record ban": (get_client(), get_message(content="record ban", text="hello"), {}, "ban"),
+    "record delete": (get_client(), get_message(content="record delete", text="hello"), {}, "delete"),
+    "text ban": (get_client(), get_message(text="wb"), {}, "ban"),
+    "text lang": (get_client(), get_message(text="lang"), {}, "ban"),
+    "text bypass": (get_client(), get_message(text="wb nospam"), {}, ""),
+    "text delete": (get_client(), get_message(text="wd"), {}, "delete"),
+    "description bypass": (get_client(description="a wb text"), get_message(text="wb text"), {}, ""),
+    "description bypass delete": (get_client(description="a wd text"), get_message(text="wd text"), {}, ""),
+    "description other": (get_client(description="other"), get_message(text="wb"), {}, "ban"),
+    "pinned content bypass": (get_client(pinned=get_message(content="c1 c2")),
+                              get_message(content="c2", text="wd"), {}, ""),
+    "pinned text bypass": (get_client(pinned=get_message(text="the wb text")), get_message(text="wb text"), {}, ""),
+    "pinned bypass image": (get_client(pinned=get_message(text="hi there")),
+                            get_message(text="hi", image=("qr", "", True)), {"tmp/qr": {"qrcode": "x"}}, ""),
+    "forward bypass": (get_client(), get_message(forward_name="nm", text="wb"), {}, ""),
+    "forward ban": (get_client(), get_message(forward_name="wb"), {}, "ban"),
+    "forward except": (get_client(), get_message(forward_name="long wb", forward_from_chat=True), {}, "delete"),
+    "restricted": (get_client(), get_message(restricted=True), {}, "ban"),
+    "restricted bypass": (get_client(description="ab"), get_message(text="ab", restricted=True), {}, ""),
+    "file bypass": (get_client(), get_message(filename="fil wb", text="wd"), {}, ""),
+    "file ban": (get_client(), get_message(filename="wb.zip"), {}, "ban"),
+    "file lang": (get_client(), get_message(filename="lang.zip", document=True), {}, "ban"),
+    "file bypass pinned": (get_client(pinned=get_message(text="fil")), get_message(filename="fil", text="fil"), {}, ""),
+    "exe": (get_client(), get_message(exe=True), {}, "ban"),
+    "tgl": (get_client(), get_message(tgl=True, image=("wbimg", "", True)), {"tmp/wbimg": {"ocr": "wb"}}, "delete"),
+    "tgl bypass": (get_client(description="t"), get_message(text="t", tgl=True), {}, ""),
+    "qrcode ban": (get_client(), get_message(image=("qr", "", True)), {"tmp/qr": {"qrcode": "x"}}, "ban"),
+    "qrcode bypass": (get_client(), get_message(image=("qr", "", True)), {"tmp/qr": {"qrcode": "nospam"}}, ""),
+    "declared": (get_client(), get_message(declared=True, document=True), {}, ""),
+    "small image": (get_client(), get_message(image=("small", "", False)), {"tmp/small": {"color": "x"}}, ""),
+    "temp image": (get_client(), get_message(image=("temp", "", True)), {"tmp/temp": {"ocr": "wb", "color": "x"}},
+                   "delete"),
+    "ocr ban": (get_client(), get_message(image=("img", "", True)), {"tmp/img": {"ocr": "wb"}}, "ban"),
+    "ocr bypass": (get_client(), get_message(image=("img", "", True)), {"tmp/img": {"ocr": "wb nospam"}}, ""),
+    "ocr all text ban": (get_client(), get_message(text="w", image=("img", "", True)), {"tmp/img": {"ocr": "b"}},
+                         "ban"),
+    "ocr all text bypass": (get_client(), get_message(text="wd nos", image=("img", "", True)),
+                            {"tmp/img": {"ocr": "pam"}}, ""),
+    "ocr text delete": (get_client(), get_message(text="wd", image=("img", "", True)), {"tmp/img": {"ocr": "x"}},
+                        "delete"),
+    "ocr all text delete": (get_client(), get_message(text="w", image=("img", "", True)), {"tmp/img": {"ocr": "d"}},
+                            "delete"),
+    "ocr only delete": (get_client(), get_message(image=("img", "", True)), {"tmp/img": {"ocr": "wd"}}, ""),
+    "color": (get_client(), get_message(image=("img", "", True)), {"tmp/img": {"color": "x"}}, "delete"),
+    "sticker name ban": (get_client(), get_message(sticker=SimpleNamespace(set_name="wb_set")), {}, "ban"),
+    "sticker name except": (get_client(), get_message(sticker=SimpleNamespace(set_name="long wb")), {},
+                            "ban title long wb"),
+    "sticker title ban": (get_client(), get_message(sticker=SimpleNamespace(set_name="lang_set")), {},
+                          "ban title lang_set"),
+    "sticker title delete": (get_client(), get_message(sticker=SimpleNamespace(set_name="wd_set")), {},
+                             "delete title wd_set"),
+    "sticker title bypass": (get_client(description="s"), get_message(text="s", sticker=SimpleNamespace(set_name="wd")),
+                             {}, ""),
+    "sticker none": (get_client(), get_message(sticker=SimpleNamespace(set_name="")), {}, ""),
+    "preview ban": (get_client(), get_message(web_page=get_web_page(title="wb")), {}, "ban"),
+    "preview lang": (get_client(), get_message(web_page=get_web_page(site_name="lang")), {}, "ban"),
+    "preview bypass": (get_client(), get_message(web_page=get_web_page(description="nospam"), document=True), {}, ""),
+    "preview delete": (get_client(), get_message(web_page=get_web_page(description="wd")), {}, "delete"),
+    "preview media": (get_client(), get_message(web_page=get_web_page(video=True)), {}, "delete"),
+    "preview image ban": (get_client(), get_message(web_page=get_web_page(photo=get_photo("pre"))),
+                          {"tmp/pre": {"ocr": "wb"}}, "ban"),
+    "preview image bypass": (get_client(), get_message(web_page=get_web_page(photo=get_photo("pre")), video=True),
+                             {"tmp/pre": {"qrcode": "nospam"}}, ""),
+    "preview image delete": (get_client(), get_message(text="w", web_page=get_web_page(photo=get_photo("pre"))),
+                             {"tmp/pre": {"ocr": "d"}}, "delete"),
+    "preview image color": (get_client(), get_message(image=("img", "", True),
+                                                      web_page=get_web_page(photo=get_photo("pre"))),
+                            {"tmp/img": {"color": "x"}}, ""),
+    "preview image large": (get_client(), get_message(web_page=get_web_page(photo=get_photo("pre", 100))),
+                            {"tmp/pre": {"ocr": "wb", "color": "x"}}, ""),
+    "preview image declared": (get_client(), get_message(declared=True, web_page=get_web_page(photo=get_photo("p")),
+                                                         document=True), {}, ""),
+    "watch delete": (get_client(), get_message(watch_delete=True, document=True), {}, ""),
+    "watch delete ban": (get_client(), get_message(watch_delete=True, text="wb"), {}, "ban"),
+    "media": (get_client(), get_message(document=True), {}, "delete"),
+    "forward": (get_client(), get_message(forward_sender_name="name"), {}, "delete"),
+    "forward bypass description": (get_client(description="f"), get_message(text="f", forward_from=True), {}, "")
+}
+
+
+@pytest.mark.parametrize("name", list(cases))
+def test_watch_stages(baseline, filters, name):
+    client, message, case_images, expected = cases[name]
+    images.update(case_images)
+
+    old = baseline(client, message)
+    new = filters.is_watch_message(client, message, FakeContext(message))
+
+    assert old == expected
+    assert new == old
@@ -0,0 +1,66 @@
+# SCP-079-WATCH - Observe and track suspicious spam behaviors
+# Copyright (C) 2019 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-WATCH.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from plugins.functions.words import get_compiled, get_literal, get_matched_forms
+
+
+@pytest.mark.parametrize("word, text", [
+    ("bitcoin", "buy bıtcoin now"),
+    ("bitcoin", "BİTCOIN"),
+    ("bıtcoin", "buy bitcoin now"),
+    ("b[ıi]tcoin", "BİTCOİN"),
+    ("bitcoin|ethereum", "bıtcoin")
+])
+def test_dotless_i(filters, word, text):
+    # The rules match the variants of i as the re module does
+    assert re.search(word, text, re.I | re.M | re.S)
+
+    word_matched, result = get_matched_forms(get_compiled([word]), filters.get_forms(text))
+
+    assert word_matched == word
+    assert result
+
+
+def test_dotless_i_literal():
+    # The literal of the prefilter is folded as the text is
+    assert get_literal("bıtcoin") == "bitcoin"
+
+
+def test_failed_results_not_cached(monkeypatch, filters, glovar):
+    # A failed check of the process pool is not cached as a clean text
+    def apply(*args):
+        raise RuntimeError("pool is closed")
+
+    monkeypatch.setattr(glovar, "pool", True)
+    monkeypatch.setattr(glovar, "pool_size", 0)
+    monkeypatch.setattr(glovar, "verdicts", OrderedDict())
+    monkeypatch.setattr(filters, "get_pool", lambda: SimpleNamespace(apply=apply))
+
+    assert filters.get_regex_results("failed text", False) is None
+    assert not glovar.verdicts
+
+    monkeypatch.setattr(glovar, "pool", False)
+
+    assert filters.get_regex_results("failed text", False) == {}
+    assert len(glovar.verdicts) == 1